@@ -24,22 +24,18 @@
 #
 # ####################################################################
 
+import time
+# the start of the imports (see --startup-time below)
+IMPORT_START = time.perf_counter()
+
 import os
-from pathlib import Path
-from os.path import exists
 import sys
 import warnings
 import csv
+import tempfile
+from collections import OrderedDict
 import numpy as np # pip install numpy
 
-from scipy import fft
-import pywt  # pip install PyWavelets
-import pywt.data
-import librosa # pip install librosa
-import soundfile # pip install soundfile
-import PIL  # pip install Pillow
-from PIL import Image
-
 from PySide2 import QtGui, QtWidgets, QtCharts, QtCore, QtMultimedia # pip install PySide2
 
 # import PySide2 before matplotlib
@@ -49,7 +45,24 @@ from matplotlib.figure import Figure
 
 matplotlib.use("Qt5Agg")
 
+# the small images of the paintings
+from PlayingPaintingsThumbnails import make_small_image, small_image_filename, \
+    small_image_is_valid, SMALL_SIZE
+# the time and the memory of the stages of the analysis
+from PlayingPaintingsProfiler import StageProfiler
+
 CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
+# the directory where the new pieces of music are saved
+OUTPUT_DIR = "./_output/"
+
+
+def engine_module():
+    # the numerical kernel of the app (PlayingPaintingsEngine.py). It imports
+    # scipy, pywt and soundfile, which are not needed to show the window:
+    # it is imported by the first call, usually by EngineWarmUpWorker in
+    # background as soon as the window is shown (the import is thread safe).
+    import PlayingPaintingsEngine
+    return PlayingPaintingsEngine
 
 
 class PaintingListComboBox(QtWidgets.QComboBox):
@@ -71,8 +84,7 @@ class ScaledPixmap(QtGui.QPixmap):
     # save its scaled version in self.scaled_pixmap
     def __init__(self, filename, directory):
         super().__init__()
-        paintings_dir_small = "./_small/"
-        self.load(paintings_dir_small + filename + "_small.png")
+        self.load(small_image_filename(filename))
         self.scaled_pixmap = self.scale()
         # print("filename", filename)
         # print("directory",paintings_dir_small)
@@ -90,6 +102,37 @@ class ScaledPixmap(QtGui.QPixmap):
         return scaled_pixmap
 
 
+class PixmapCache:
+    # LRU cache of the small images of the paintings shown in the gui,
+    # within max_bytes (like QPixmapCache): browsing the paintings reads
+    # each small image from disk only once.
+    def __init__(self, max_bytes=64*2**20):
+        self.max_bytes = max_bytes
+        self.pixmaps = OrderedDict()
+        self.nbytes = 0
+
+    def get(self, name):
+        if name not in self.pixmaps:
+            return None
+        self.pixmaps.move_to_end(name)
+        return self.pixmaps[name]
+
+    def put(self, name, pixmap):
+        self.remove(name)
+        self.pixmaps[name] = pixmap
+        self.nbytes += self.pixmap_bytes(pixmap)
+        while self.nbytes > self.max_bytes and len(self.pixmaps) > 1:
+            old_name, old_pixmap = self.pixmaps.popitem(last=False)
+            self.nbytes -= self.pixmap_bytes(old_pixmap)
+
+    def remove(self, name):
+        if name in self.pixmaps:
+            self.nbytes -= self.pixmap_bytes(self.pixmaps.pop(name))
+
+    def pixmap_bytes(self, pixmap):
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+
 class MusicListWidget(QtWidgets.QListWidget):
     # A Widget to read the list of music tracks
     def __init__(self, music_list_filename):
@@ -155,7 +198,77 @@ class WaveletLabel(QtWidgets.QWidget):
         self.setLayout(ll)
 
 
-class SignalMplCanvas(FigureCanvasQTAgg):
+def min_max_envelope(x, y, n_bins, log_x=False):
+    # reduce the series y(x) (x increasing) to the minimum and the maximum of y
+    # in n_bins bins of equal width on the screen (on a logarithmic x axis if
+    # log_x): plotted, the 2*n_bins points look the same as the whole series.
+    if log_x:
+        # the points with x <= 0 are not shown on a logarithmic axis
+        first = np.searchsorted(x, 0, side='right')
+        x = x[first:]
+        y = y[first:]
+    if y.size <= 2 * n_bins:
+        return x, y
+    if log_x:
+        edges = np.geomspace(x[0], x[-1], n_bins + 1)
+    else:
+        edges = np.linspace(x[0], x[-1], n_bins + 1)
+    # the first point of each (non-empty) bin
+    start = np.unique(np.searchsorted(x, edges[:-1]))
+    y_min = np.minimum.reduceat(y, start)
+    y_max = np.maximum.reduceat(y, start)
+    return np.repeat(x[start], 2), np.column_stack([y_min, y_max]).ravel()
+
+
+class EnvelopeMplCanvas(FigureCanvasQTAgg):
+    # Matplot object which plots long series by their min/max envelope
+    # (see min_max_envelope), with one bin for each pixel of the axes.
+    # The envelopes are computed again only when the canvas is resized
+    # or the x range of the axes changes (e.g. zoom).
+    def __init__(self, fig):
+        super().__init__(fig)
+        # [line, x, y, log_x, (width, xlim) of the current envelope]
+        self.envelopes = []
+        self.envelope_callbacks = None
+        self.mpl_connect('resize_event', self.update_envelopes)
+
+    def plot_envelope(self, x, y, log_x=False, **kwargs):
+        if self.envelope_callbacks is not self.axes.callbacks:
+            # axes.clear() removes the lines and resets the callbacks of the axes
+            self.envelopes = []
+            self.axes.callbacks.connect('xlim_changed', self.update_envelopes)
+            self.envelope_callbacks = self.axes.callbacks
+        line, = self.axes.plot(x[0:1], y[0:1], **kwargs)
+        envelope = [line, x, y, log_x, None]
+        self.envelopes.append(envelope)
+        self.update_envelope(envelope, whole_range=True)
+        return line
+
+    def update_envelopes(self, *args):
+        for envelope in self.envelopes:
+            self.update_envelope(envelope)
+
+    def update_envelope(self, envelope, whole_range=False):
+        line, x, y, log_x, key = envelope
+        # the width of the axes in pixels (the figure can be much larger
+        # before the widget is shown)
+        width = min(max(int(self.axes.get_window_extent().width), 1), 4096)
+        if whole_range:
+            x_min, x_max = x[0], x[-1]
+        else:
+            x_min, x_max = self.axes.get_xlim()
+        if key == (width, x_min, x_max):
+            return
+        # the visible points, and one more on each side
+        first = max(np.searchsorted(x, x_min) - 1, 0)
+        last = min(np.searchsorted(x, x_max, side='right') + 1, x.size)
+        x_envelope, y_envelope = min_max_envelope(x[first:last], y[first:last],
+                                                  width, log_x)
+        line.set_data(x_envelope, y_envelope)
+        envelope[4] = (width, x_min, x_max)
+
+
+class SignalMplCanvas(EnvelopeMplCanvas):
     #  Matplot object to plot signals
     def __init__(self, width=4, height=1):
         # width and height in inches
@@ -174,7 +287,7 @@ class SignalMplCanvas(FigureCanvasQTAgg):
         # samplerate, data = wavfile.read(filename)
         length = data.shape[0] / samplerate
         time = np.linspace(0., length, data.shape[0])
-        self.axes.plot(time, data, color=color, linewidth=1)
+        self.plot_envelope(time, data, color=color, linewidth=1)
         self.axes.set_xlim(time[0], time[-1])
         self.axes.set_ylim(-1, 1)
         self.axes.annotate(plotname, xy=(10, 5), xycoords='figure pixels',
@@ -190,7 +303,7 @@ class SignalMplCanvas(FigureCanvasQTAgg):
         self.draw()
 
 
-class TransformMplCanvas(FigureCanvasQTAgg):
+class TransformMplCanvas(EnvelopeMplCanvas):
     # build a PlotWidget to plot the signal read from file
     def __init__(self, width=6, height=1, dpi=100):
         fig = Figure(figsize=(width, height), dpi=dpi, layout='constrained')
@@ -205,7 +318,7 @@ class TransformMplCanvas(FigureCanvasQTAgg):
 
     def my_plot_dwt(self, y, plotname, color):
         x = np.linspace(0, y.size, y.size)
-        self.axes.semilogx(x, y, color=color, linewidth=1.0)
+        self.plot_envelope(x, y, log_x=True, color=color, linewidth=1.0)
         # Set Range
         self.axes.set_xlim(1, x.size)
         self.axes.set_ylim(-np.amax(y), np.amax(y))
@@ -213,11 +326,14 @@ class TransformMplCanvas(FigureCanvasQTAgg):
         self.axes.annotate(plotname, xy=(10, 5), xycoords='figure pixels',
                            color=color, fontsize=11, weight="bold")
 
-    def my_plot_dft(self, y, plotname, color, sample_rate):
-        n = y.size
-        x = fft.fftfreq(n, 1./sample_rate)[0:n//2]
+    def my_plot_dft(self, y, plotname, color, sample_rate, n=None):
+        # y: the spectrum of a signal of length n (default y.size), or
+        # just its first half (at least n//2 entries)
+        if n is None:
+            n = y.size
+        x = np.fft.fftfreq(n, 1./sample_rate)[0:n//2]
         yy = np.abs(y[1:n//2])
-        self.axes.semilogx(x[1:], yy, color=color, linewidth=1.0)
+        self.plot_envelope(x[1:], yy, log_x=True, color=color, linewidth=1.0)
         # Set Range
         self.axes.set_xlim(1, x[-1])
         self.axes.set_ylim(0, np.amax(yy))
@@ -347,11 +463,86 @@ class Distance(QtWidgets.QLabel):
 
 
 class Player(QtMultimedia.QMediaPlayer):
-    def __init__(self, directory, music):
+    # a player of a music track, created once (see MainWindow.create_players):
+    # set_track replaces its track
+    def __init__(self):
+        super().__init__()
+        self.filename = None
+
+    def set_track(self, filename):
+        # load filename (None: release the current track). The media starts
+        # buffering at once; the same track is not loaded again.
+        if filename == self.filename:
+            return
+        self.stop()
+        self.filename = filename
+        if filename is None:
+            self.setMedia(QtMultimedia.QMediaContent())
+        else:
+            url = QtCore.QUrl.fromLocalFile(filename)
+            self.setMedia(QtMultimedia.QMediaContent(url))
+
+
+class SignalPlayer(QtCore.QObject):
+    # play a signal held in memory (the new piece of music), with the
+    # play() and pause() of Player: set_signal converts the signal once to
+    # 16-bit PCM in a QBuffer, played by QAudioOutput, without writing it
+    # to disk and decoding it again. The player is created once and reused.
+    def __init__(self):
         super().__init__()
-        filename = os.path.join(directory, music)
-        url = QtCore.QUrl.fromLocalFile(filename)
-        self.setMedia(QtMultimedia.QMediaContent(url))
+        self.buffer = QtCore.QBuffer(self)
+        self.output = None
+        self.sample_rate = None
+
+    def set_signal(self, signal, sample_rate):
+        self.stop()
+        self.buffer.close()
+        pcm = np.round(np.clip(signal, -1, 1) * 32767).astype('<i2')
+        self.buffer.setData(QtCore.QByteArray(pcm.tobytes()))
+        self.buffer.open(QtCore.QIODevice.ReadOnly)
+        if sample_rate != self.sample_rate:
+            # a new output only when the format changes
+            if self.output is not None:
+                self.output.deleteLater()
+            audio_format = QtMultimedia.QAudioFormat()
+            audio_format.setSampleRate(int(sample_rate))
+            audio_format.setChannelCount(1)
+            audio_format.setSampleSize(16)
+            audio_format.setCodec("audio/pcm")
+            audio_format.setByteOrder(QtMultimedia.QAudioFormat.LittleEndian)
+            audio_format.setSampleType(QtMultimedia.QAudioFormat.SignedInt)
+            self.output = QtMultimedia.QAudioOutput(audio_format, self)
+            self.sample_rate = sample_rate
+
+    def play(self):
+        if self.output is None:
+            return
+        state = self.output.state()
+        if state == QtMultimedia.QAudio.SuspendedState:
+            self.output.resume()
+        elif state != QtMultimedia.QAudio.ActiveState:
+            # from the beginning, also when the end has been reached
+            self.buffer.seek(0)
+            self.output.start(self.buffer)
+
+    def pause(self):
+        if self.output is not None and self.output.state() == QtMultimedia.QAudio.ActiveState:
+            self.output.suspend()
+
+    def stop(self):
+        if self.output is not None:
+            self.output.stop()
+
+
+def unique_output_file(name):
+    # a new wav file in OUTPUT_DIR for the piece of music of the painting
+    # name: the runs and the instances of the app never overwrite each other
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    handle, filename = tempfile.mkstemp(
+        prefix=name + "_" + time.strftime("%Y%m%d-%H%M%S") + "_",
+        suffix=".wav", dir=OUTPUT_DIR)
+    os.close(handle)
+    return filename
 
 
 class PlayButton(QtWidgets.QPushButton):
@@ -367,9 +558,50 @@ class PlayButton(QtWidgets.QPushButton):
         self.setIconSize(QtCore.QSize(26, 26))
 
 
+class AnalysisSignals(QtCore.QObject):
+    # the signals emitted by AnalysisWorker; they are delivered to the slots
+    # of the main window in the GUI thread.
+    progress = QtCore.Signal(str, int, object)
+    finished = QtCore.Signal(object)
+    cancelled = QtCore.Signal()
+    failed = QtCore.Signal(str)
+
+
+class AnalysisWorker(QtCore.QRunnable):
+    # run a method of PlayingPaintingsEngine (run or scan_library) outside
+    # the Qt event loop
+    def __init__(self, function, *args, **kwargs):
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = AnalysisSignals()
+        self.cancel_requested = False
+
+    def cancel(self):
+        # the engine stops at the end of the current stage
+        self.cancel_requested = True
+
+    def is_cancelled(self):
+        return self.cancel_requested
+
+    def run(self):
+        try:
+            result = self.function(*self.args,
+                                   progress=self.signals.progress.emit,
+                                   cancelled=self.is_cancelled,
+                                   **self.kwargs)
+        except engine_module().AnalysisCancelled:
+            self.signals.cancelled.emit()
+        except Exception as error:
+            self.signals.failed.emit(str(error))
+        else:
+            self.signals.finished.emit(result)
+
 
 class MainWindow(QtWidgets.QMainWindow):
-    def __init__(self, music_dir, music_list_filename, paintings_dir, paintings_list_filename):
+    def __init__(self, music_dir, music_list_filename, paintings_dir, paintings_list_filename,
+                 profile=False, trace_memory=False, profile_log=None):
         super().__init__()
         self.setWindowTitle("Playing paintings")
         self.setGeometry(100, 100, 1300, 800)
@@ -386,11 +618,31 @@ class MainWindow(QtWidgets.QMainWindow):
         self.mother_wavelet = "db5"
         self.wave_nlevels = 8
         self.transform = 0
+        self.fast_length = False
+        self.single_precision = False
+        # the preview is shown while the full analysis runs
+        self.preview = True
+        self.showing_preview = False
+        self.full_engine = None
 
         self.color_tracks = ["#66b2ff","#3399ff", "#0066cc", "#003366"]
         self.color_painting = ["#ff0000", "#ec7d0d"]
 
         self.counter_go = 0
+        self.worker = None
+        # the result of the last analysis and the file where its new piece
+        # of music has been saved (None until Save is pressed)
+        self.result = None
+        self.piece_file = None
+        # measure the stages of each run (see PlayingPaintingsProfiler.py)
+        self.profile = profile or trace_memory or profile_log is not None
+        self.trace_memory = trace_memory
+        self.profile_log = profile_log
+        self.profiler = None
+        # the caches of the engine, shared by all the runs (see new_engine)
+        self.audio_cache = None
+        self.coeffs_cache = None
+        self.gram_index = None
         self.alpha = np.zeros([4])
         self.alpha_percento = np.zeros([4])
         # local variables
@@ -438,6 +690,12 @@ class MainWindow(QtWidgets.QMainWindow):
         left_widget_list.append(painting_menu)
 # create the object for the scaled image (empty image)
         self.pixmap = ScaledPixmap(painting_name, self.music_dir)
+# the small images already loaded, the paintings whose small image is
+# being generated and the image shown meanwhile
+        self.pixmap_cache = PixmapCache()
+        self.pending_small_images = set()
+        self.placeholder_pixmap = QtGui.QPixmap(SMALL_SIZE, SMALL_SIZE)
+        self.placeholder_pixmap.fill(QtGui.QColor("#dddddd"))
         # send the signal to the slot self.load_image_gui to show the image in the gui
         painting_menu.currentTextChanged.connect(self.load_image_gui)
         self.selected_painting = painting_name
@@ -465,6 +723,13 @@ class MainWindow(QtWidgets.QMainWindow):
         self.music_list.setLayout(music_layout)
         left_widget_list.append(self.music_list)
 
+        # compare the painting with all the tracks and select the best ones
+        self.scanbutton = QtWidgets.QPushButton("Suggest 4 tracks")
+        self.scanbutton.setToolTip("Compare the painting with all the tracks of the list "
+                                   "and select the 4 tracks which fit it best")
+        self.scanbutton.clicked.connect(self.scan_library)
+        left_widget_list.append(self.scanbutton)
+
         # 5. QvBox with the list of discrete transforms
 # Choice of the discrete transform.
         transforms_widget = QtWidgets.QGroupBox()
@@ -488,6 +753,29 @@ class MainWindow(QtWidgets.QMainWindow):
         self.transform_widget = TransformButtonGroup(self)
         transforms_layout.addWidget(self.transform_widget.w)
 
+        # pad the signals to a length with small prime factors:
+        # much faster for the paintings whose number of pixels is not
+        self.fast_length_box = QtWidgets.QCheckBox("Fast DFT length")
+        self.fast_length_box.setToolTip(
+            "Pad the image and the music tracks with zeros to a length which\n"
+            "the DFT computes fast (the results change slightly).\n"
+            "Only for DFT - 1D unrolling.")
+        self.fast_length_box.setChecked(self.fast_length)
+        self.fast_length_box.toggled.connect(self.select_fast_length)
+        transforms_layout.addWidget(self.fast_length_box)
+        label_description = QtWidgets.QLabel("(only for DFT - 1D unrolling)")
+        label_description.setFont(QtGui.QFont('Arial', 8))
+        transforms_layout.addWidget(label_description)
+
+        # half the memory for the largest paintings
+        self.single_precision_box = QtWidgets.QCheckBox("Single precision")
+        self.single_precision_box.setToolTip(
+            "Compute in single precision: half the memory, the weights and\n"
+            "the distance change slightly (see README.md)")
+        self.single_precision_box.setChecked(self.single_precision)
+        self.single_precision_box.toggled.connect(self.select_single_precision)
+        transforms_layout.addWidget(self.single_precision_box)
+
         left_widget_list.append(transforms_widget)
 
         # 6. mother wavelet
@@ -635,9 +923,18 @@ class MainWindow(QtWidgets.QMainWindow):
         self.pausebutton_painting.setEnabled(False)
         self.painting_button_layout.addWidget(self.pausebutton_painting,
                                               alignment=QtCore.Qt.AlignHCenter)
+        # save the new piece of music (it is played from memory)
+        self.savebutton_painting = QtWidgets.QPushButton("Save")
+        self.savebutton_painting.setFixedSize(60, 30)
+        self.savebutton_painting.setToolTip("Save the new piece of music in " + OUTPUT_DIR)
+        self.savebutton_painting.setEnabled(False)
+        self.savebutton_painting.clicked.connect(self.save_piece)
+        self.painting_button_layout.addWidget(self.savebutton_painting,
+                                              alignment=QtCore.Qt.AlignHCenter)
         self.painting_button_widget.setMaximumWidth(100)
         plot_layout.addWidget(self.painting_button_widget, k, 0,
                               alignment=QtCore.Qt.AlignHCenter)
+        self.create_players()
 
         # Column 1: signals
         signals_title = QtWidgets.QLabel("Waveforms of the music tracks")
@@ -705,6 +1002,15 @@ class MainWindow(QtWidgets.QMainWindow):
         goclear_layout.addWidget(self.gobutton, alignment=QtCore.Qt.AlignHCenter)
         self.gobutton.clicked.connect(self.numeric_elaboration)
 
+        # first a quick analysis of the reduced painting, then the full one
+        self.previewbox = QtWidgets.QCheckBox("Quick preview")
+        self.previewbox.setToolTip(
+            "Show at once the results for a reduced painting,\n"
+            "then replace them with the full resolution ones")
+        self.previewbox.setChecked(self.preview)
+        self.previewbox.toggled.connect(self.select_preview)
+        goclear_layout.addWidget(self.previewbox, alignment=QtCore.Qt.AlignHCenter)
+
         # Clear
         self.clearbutton = QtWidgets.QPushButton("clear")
         self.clearbutton.setFixedSize(QtCore.QSize(100, 30))
@@ -713,6 +1019,13 @@ class MainWindow(QtWidgets.QMainWindow):
         goclear_layout.addWidget(self.clearbutton, alignment=QtCore.Qt.AlignHCenter)
         self.clearbutton.clicked.connect(self.clear_all)
 
+        # Cancel (visible only while the elaboration is running)
+        self.cancelbutton = QtWidgets.QPushButton("cancel")
+        self.cancelbutton.setFixedSize(QtCore.QSize(100, 30))
+        goclear_layout.addWidget(self.cancelbutton, alignment=QtCore.Qt.AlignHCenter)
+        self.cancelbutton.clicked.connect(self.cancel_elaboration)
+        self.cancelbutton.hide()
+
         # Help for Clear button
         self.helpclearbutton = QtWidgets.QLabel("To run again, press the clear button and change the inputs")
         self.helpclearbutton.setFont(QtGui.QFont('Arial', 10))
@@ -741,16 +1054,51 @@ class MainWindow(QtWidgets.QMainWindow):
     def load_image_gui(self, text):
         # update the image name from the ComboBox
         # load the image and save it in self.image.
-        self.pixmap = ScaledPixmap(text, self.paintings_dir)
-        self.image.setPixmap(self.pixmap.scaled_pixmap)
+        self.show_small_image(text)
         self.set_selected_painting(text)
         self.counter_go += 10
-        if self.counter_go >= 21 and not self.clearbutton.isEnabled():
+        if self.counter_go >= 21 and not self.clearbutton.isEnabled() \
+                and self.worker is None:
             self.gobutton.setEnabled(True)
             self.gobutton.setStyleSheet('QPushButton {background-color: #0066CC; color: white;}'
                                         'QPushButton::pressed {background-color: #FF8800; color: white;}')
 
 
+    def show_small_image(self, name):
+        # show the small image of the painting: from the cache, from disk,
+        # or generate it in the background (and show a placeholder meanwhile)
+        pixmap = self.pixmap_cache.get(name)
+        if pixmap is None:
+            if small_image_is_valid(self.paintings_dir, name):
+                self.pixmap = ScaledPixmap(name, self.paintings_dir)
+                if self.pixmap.isNull():
+                    pixmap = self.placeholder_pixmap
+                else:
+                    pixmap = self.pixmap.scaled_pixmap
+                    self.pixmap_cache.put(name, pixmap)
+            else:
+                pixmap = self.placeholder_pixmap
+                if name not in self.pending_small_images:
+                    self.pending_small_images.add(name)
+                    thumbnail = ThumbnailWorker(self.paintings_dir, name)
+                    thumbnail.signals.ready.connect(self.small_image_ready)
+                    thumbnail.signals.failed.connect(self.small_image_failed)
+                    QtCore.QThreadPool.globalInstance().start(thumbnail)
+        self.image.setPixmap(pixmap)
+
+    def small_image_ready(self, name):
+        # the small image of a painting has been generated:
+        # show it if the painting is selected
+        self.pending_small_images.discard(name)
+        self.pixmap_cache.remove(name)
+        if name == self.painting_name:
+            self.show_small_image(name)
+
+    def small_image_failed(self, name):
+        # the small image of a painting cannot be generated:
+        # the placeholder stays, and it is tried again at the next selection
+        self.pending_small_images.discard(name)
+
     def set_selected_painting(self, selected_painting):
         self.painting_name = selected_painting
         # print("selected painting", self.painting_name)
@@ -764,7 +1112,8 @@ class MainWindow(QtWidgets.QMainWindow):
             selected_tracks_list.append(item.text())
         self.save_selected_tracks(selected_tracks_list)
         self.counter_go += 1
-        if self.counter_go >= 21 and not self.clearbutton.isEnabled():
+        if self.counter_go >= 21 and not self.clearbutton.isEnabled() \
+                and self.worker is None:
             self.gobutton.setEnabled(True)
             self.gobutton.setStyleSheet('QPushButton {background-color: #0066CC; color: white;}'
                                         'QPushButton::pressed {background-color: #FF8800; color: white;}')
@@ -777,13 +1126,48 @@ class MainWindow(QtWidgets.QMainWindow):
             n_tracks = 4
         self.selected_tracks = selected_tracks
         self.n_selected_tracks = n_tracks  # number of selected tracks
+        self.prepare_players()
         # print("number of selected tracks", self.n_selected_tracks)
         # print("save_selected_tracks: selected tracks", self.selected_tracks)
 
+    def create_players(self):
+        # the pool of the players, created once for the whole session: the
+        # new piece of music (from memory) and the four music tracks. The
+        # buttons are connected here only: the runs replace the sources.
+        self.player_painting = SignalPlayer()
+        self.players_music = [Player() for k in range(4)]
+        self.playbuttons_music = [self.playbutton_music0, self.playbutton_music1,
+                                  self.playbutton_music2, self.playbutton_music3]
+        self.pausebuttons_music = [self.pausebutton_music0, self.pausebutton_music1,
+                                   self.pausebutton_music2, self.pausebutton_music3]
+        buttons = [(self.playbutton_painting, self.pausebutton_painting, self.player_painting)]
+        buttons += zip(self.playbuttons_music, self.pausebuttons_music, self.players_music)
+        for playbutton, pausebutton, player in buttons:
+            playbutton.clicked.connect(
+                lambda checked=False, player=player: self.click_playbutton(player))
+            pausebutton.clicked.connect(
+                lambda checked=False, player=player: self.click_pausebutton(player))
+
+    def prepare_players(self):
+        # load the selected tracks in their players as soon as they are
+        # selected, so that they are buffered before the analysis ends;
+        # the other players release their track. While the results are
+        # shown, the players keep the analysed tracks (see load_players):
+        # the selection is loaded by Clear.
+        if self.clearbutton.isEnabled():
+            return
+        self.load_players([self.music_dir + item for item in self.selected_tracks])
+
+    def load_players(self, track_files):
+        # the music tracks track_files in the first players of the pool
+        for k, player in enumerate(self.players_music):
+            player.set_track(track_files[k] if k < len(track_files) else None)
+
     def set_selected_transform(self):
         self.set_transform(self.transform_widget.checkedId())
         self.counter_go += 10
-        if self.counter_go >= 21 and not self.clearbutton.isEnabled():
+        if self.counter_go >= 21 and not self.clearbutton.isEnabled() \
+                and self.worker is None:
             self.gobutton.setEnabled(True)
             self.gobutton.setStyleSheet('QPushButton {background-color: #0066CC; color: white;}'
                                         'QPushButton::pressed {background-color: #FF8800; color: white;}')
@@ -793,9 +1177,18 @@ class MainWindow(QtWidgets.QMainWindow):
     def set_transform(self, value):
         self.transform = value
 
+    def select_fast_length(self, checked):
+        self.fast_length = checked
+        self.activate_gobutton()
+
+    def select_single_precision(self, checked):
+        self.single_precision = checked
+        self.activate_gobutton()
+
     def select_mother_wavelet(self, text):
         self.mother_wavelet = text
-        if self.counter_go >= 21 and not self.clearbutton.isEnabled():
+        if self.counter_go >= 21 and not self.clearbutton.isEnabled() \
+                and self.worker is None:
             self.gobutton.setEnabled(True)
             self.gobutton.setStyleSheet('QPushButton {background-color: #0066CC; color: white;}'
                                         'QPushButton::clicked {background-color: #FF0000; color: white;}')
@@ -804,7 +1197,8 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def select_levels_wavelet(self, levels):
         self.wave_nlevels = levels
-        if self.counter_go >= 21 and not self.clearbutton.isEnabled():
+        if self.counter_go >= 21 and not self.clearbutton.isEnabled() \
+                and self.worker is None:
             self.gobutton.setEnabled(True)
             self.gobutton.setStyleSheet('QPushButton {background-color: #0066CC; color: white;}'
                                         'QPushButton::pressed {background-color: #FF8800; color: white;}')
@@ -837,9 +1231,16 @@ class MainWindow(QtWidgets.QMainWindow):
         self.pausebutton_music2.setEnabled(False)
         self.pausebutton_music3.setEnabled(False)
         self.pausebutton_painting.setEnabled(False)
+        self.savebutton_painting.setEnabled(False)
+        # stop the sounds whose buttons are disabled
+        self.player_painting.stop()
+        for player in self.players_music:
+            player.stop()
 
         self.helpclearbutton.hide()
         self.helpgobutton.setText("Select the inputs on the left. After pressing the Go button, wait for the elaboration.")
+        # the players are free for the current selection
+        self.prepare_players()
 
     def clean_gobutton(self):
         # deactivate the go button
@@ -849,211 +1250,352 @@ class MainWindow(QtWidgets.QMainWindow):
 
 # the kernel of the app
     def numeric_elaboration(self):
+        # start the analysis (see PlayingPaintingsEngine.py) on a worker
+        # thread; the plots are filled by show_progress as the results arrive.
+        if self.worker is not None:
+            return
+
+        # deactivate the go button
+        self.gobutton.setEnabled(False)
+        self.gobutton.setStyleSheet('QPushButton')
+        self.cancelbutton.show()
 
         # fill the legend
         self.legend_widget.fill_legend(self.selected_tracks, self.color_tracks)
 
-        # read and transform the image
-        self.image_elaboration()
+        self.scanbutton.setEnabled(False)
+        self.start_profiler()
+        engine = self.new_engine()
+        # the inputs of the analysis, the same for the preview and the full
+        # analysis even if the selection changes meanwhile
+        painting_file = self.painting_file()
+        track_files = [self.music_dir + item for item in self.selected_tracks]
+        self.helpgobutton.setText("Reading the painting...")
+        preview_engine = None
+        if self.preview:
+            try:
+                preview_engine = engine.preview_engine(painting_file)
+            except OSError:
+                # the full analysis reports the error
+                pass
+        if preview_engine is None:
+            self.start_elaboration(engine, painting_file, track_files)
+        else:
+            # the full analysis starts when the preview is shown
+            self.full_engine = engine
+            self.start_worker(preview_engine.run, painting_file, track_files,
+                              self.preview_finished)
+
+    def painting_file(self):
+        return self.paintings_dir + self.painting_name + ".png"
+
+    def start_worker(self, function, painting_file, track_files, finished, **kwargs):
+        # run function (PlayingPaintingsEngine.run) on the painting and the tracks
+        self.worker = AnalysisWorker(function, painting_file, track_files, **kwargs)
+        self.worker.signals.progress.connect(self.show_progress)
+        self.worker.signals.finished.connect(finished)
+        self.worker.signals.cancelled.connect(self.elaboration_stopped)
+        self.worker.signals.failed.connect(self.elaboration_failed)
+        QtCore.QThreadPool.globalInstance().start(self.worker)
+
+    def start_elaboration(self, engine, painting_file, track_files):
+        # the full analysis (the new piece of music is played from memory,
+        # and saved only on request, see save_piece)
+        if self.profiler is not None:
+            # measure the full analysis only
+            self.profiler.begin()
+        self.cancelbutton.setEnabled(True)
+        self.start_worker(engine.run, painting_file, track_files,
+                          self.elaboration_finished)
+
+    def preview_finished(self, result):
+        # slot called when the preview is complete: show its weights
+        # and distance, then start the full analysis
+        if self.worker is not None and self.worker.is_cancelled():
+            # Cancel was pressed after the last stage of the preview
+            self.elaboration_stopped()
+            return
+        self.pie_widget.clear_pie()
+        self.pie_widget.fill_pie(result.alpha_percento,
+                                 [os.path.basename(item) for item in result.track_files],
+                                 self.color_tracks)
+        self.distance_widget.fill_distances(result.distance)
+        self.showing_preview = True
+        engine = self.full_engine
+        self.full_engine = None
+        # the inputs of the preview
+        self.start_elaboration(engine, result.painting_file, result.track_files)
+        self.helpgobutton.setText("Preview (painting reduced by {}). "
+                                  "Computing the full resolution...".format(
+                                      result.scale))
+
+    def select_preview(self, checked):
+        self.preview = checked
+
+    def new_engine(self):
+        # the numerical kernel, with the inputs selected in the gui
+        engine = engine_module()
+        if self.audio_cache is None:
+            # decoded music tracks
+            self.audio_cache = engine.AudioCache("./_cache/audio/")
+            # transforms of the music tracks, kept in memory during the session
+            self.coeffs_cache = engine.CoefficientCache(max_bytes=512*2**20)
+            # inner products of the tracks, to compare the painting with all of them
+            self.gram_index = engine.GramIndex("./_cache/gram/")
+        return engine.PlayingPaintingsEngine(transform=self.transform,
+                                      mother_wavelet=self.mother_wavelet,
+                                      wave_nlevels=self.wave_nlevels,
+                                      my_sample_rate=self.my_sample_rate,
+                                      audio_cache=self.audio_cache,
+                                      coeffs_cache=self.coeffs_cache,
+                                      gram_index=self.gram_index,
+                                      profiler=self.profiler,
+                                      fast_length=self.fast_length,
+                                      single_precision=self.single_precision)
+
+    def start_profiler(self):
+        # a new profiler for the next run, if the stages are measured
+        self.discard_profiler()
+        if self.profile:
+            self.profiler = StageProfiler(trace_memory=self.trace_memory)
+            self.profiler.begin()
+
+    def discard_profiler(self):
+        # drop the profiler of a run that did not finish: it is ended first,
+        # so that it stops tracing the memory allocations
+        if self.profiler is not None:
+            self.profiler.end()
+        self.profiler = None
+
+    def stop_profiler(self, result):
+        # show the measures of the run in the status bar (the whole table
+        # in its tooltip) and append them to the log, if any
+        if self.profiler is None:
+            return
+        self.profiler.end()
+        self.statusBar().showMessage(self.profiler.summary())
+        self.statusBar().setToolTip("<pre>" + self.profiler.report() + "</pre>")
+        if self.profile_log is not None:
+            self.profiler.write_log(self.profile_log, painting=result.painting_file,
+                                    tracks=result.track_files, transform=self.transform,
+                                    wavelet=self.mother_wavelet, levels=self.wave_nlevels)
+        self.profiler = None
+
+    def activate_gobutton(self):
+        # not while an analysis or a scan is running: the inputs can change,
+        # but a second worker would draw into the same plots
+        if self.counter_go >= 21 and not self.clearbutton.isEnabled() \
+                and self.worker is None:
+            self.gobutton.setEnabled(True)
+            self.gobutton.setStyleSheet('QPushButton {background-color: #0066CC; color: white;}'
+                                        'QPushButton::pressed {background-color: #FF8800; color: white;}')
+
+    def scan_library(self):
+        # rank all the tracks of the list against the painting (on a worker
+        # thread) and select the best 4 of them
+        if self.worker is not None:
+            return
+        if self.painting_name.strip() == "":
+            self.helpgobutton.setText("Choose the painting first.")
+            return
+        self.gobutton.setEnabled(False)
+        self.gobutton.setStyleSheet('QPushButton')
+        self.scanbutton.setEnabled(False)
+        self.cancelbutton.show()
+        self.library_tracks = [self.music_list.item(k).text()
+                               for k in range(self.music_list.count())]
+        self.start_profiler()
+        engine = self.new_engine()
+        self.worker = AnalysisWorker(engine.scan_library,
+                                     self.paintings_dir + self.painting_name + ".png",
+                                     [self.music_dir + item for item in self.library_tracks],
+                                     n_best=4)
+        self.worker.signals.progress.connect(self.show_scan_progress)
+        self.worker.signals.finished.connect(self.scan_finished)
+        self.worker.signals.cancelled.connect(self.scan_stopped)
+        self.worker.signals.failed.connect(self.scan_failed)
+        self.helpgobutton.setText("Reading the painting...")
+        QtCore.QThreadPool.globalInstance().start(self.worker)
+
+    def show_scan_progress(self, stage, index, result):
+        if stage == 'scan':
+            self.helpgobutton.setText("Comparing with: " + self.library_tracks[index])
+        elif stage == 'solve':
+            self.helpgobutton.setText("Computing the weights...")
+
+    def scan_finished(self, result):
+        # show the distance of each track in its tooltip and
+        # select the best subset of tracks
+        self.stop_profiler(result)
+        for k, distance in enumerate(result.distances):
+            item = self.music_list.item(k)
+            if np.isnan(distance):
+                item.setToolTip("this track cannot be read")
+            else:
+                item.setToolTip("rank {}, normalized distance {:.6f}".format(
+                    result.ranking.index(k) + 1, distance))
+        self.music_list.clearSelection()
+        for k in result.best_subset:
+            self.music_list.item(k).setSelected(True)
+        self.scan_stopped()
+        self.helpgobutton.setText("Suggested tracks selected (distance {:.4f}). "
+                                  "Press Go to listen.".format(result.distance))
+
+    def scan_stopped(self):
+        self.worker = None
+        self.discard_profiler()
+        self.cancelbutton.hide()
+        self.cancelbutton.setEnabled(True)
+        self.scanbutton.setEnabled(True)
+        self.helpgobutton.setText("Select the inputs on the left. After pressing the Go button, wait for the elaboration.")
+        self.activate_gobutton()
+
+    def scan_failed(self, message):
+        self.scan_stopped()
+        self.helpgobutton.setText("Error: " + message)
 
-        # read the audio signals, plot and transform
-        ma = []
-        for item_index, item in enumerate(self.selected_tracks):
+    def show_progress(self, stage, index, result):
+        # slot called at the end of each stage of the analysis
+        if self.profiler is None:
+            self.plot_progress(stage, index, result)
+        else:
+            with self.profiler.stage('plot', index):
+                self.plot_progress(stage, index, result)
+
+    def plot_progress(self, stage, index, result):
+        # plot the results of a stage of the analysis
+        if index >= 0:
+            item = os.path.basename(result.track_files[index])
+            self.helpgobutton.setText("Track {} of {}: {} done".format(
+                index + 1, len(result.track_files),
+                "reading" if stage == 'decode' else stage))
+        else:
+            self.helpgobutton.setText("Painting: {} done".format(stage))
+        if self.showing_preview:
+            # the full analysis replaces the plots of the preview
+            if stage == 'decode' and index >= 0:
+                self.signal_widget_list[index].clear_plot()
+            elif stage == 'transform' and index >= 0:
+                self.dt_widget_list[index].clear_plot_dt()
+            elif stage == 'solve':
+                self.dt_widget_list[4].clear_plot_dt()
+                self.dt_widget_list[5].clear_plot_dt()
+            elif stage == 'reconstruct':
+                self.signal_widget_list[5].clear_plot()
+
+        if stage == 'decode' and index >= 0:
             # extract the name of the music
             music_name = os.path.splitext(item)
             music_name=music_name[0]
             music_name1=music_name.replace("-"," ")
-            # read
-            audio_signal, sample_rate = librosa.load(self.music_dir + item,
-                                                    sr=None, mono=False)
-            self.sample_rate.append(sample_rate)
-
-            # if the music track has more than one trace, select the first trace
-            # cut the audio signal to the pixels number
-            if audio_signal.shape.__len__() > 1:
-                audio_signal = (audio_signal[0] + audio_signal[1]) / 2
-            audio_length = len(audio_signal)
-
-            if audio_length < self.n_pixels:
-                # print a message and stop the execution if the music track is too short.
-                print("WARNING: The music track " + item)
-                print("is too short compared with the dimension of the image")
-                print("number of image pixels: ", self.n_pixels)
-                print("number of music-track samples: ", audio_length)
-                print("The music-track will be replicated for the computation")
-                newaudio_length = audio_length
-                newaudio_signal = audio_signal
-                while newaudio_length < self.n_pixels:
-                    newaudio_signal = np.concatenate((newaudio_signal, audio_signal),
-                                                  axis=None)
-                    newaudio_length += audio_length
-                audio_signal = newaudio_signal
-                del newaudio_signal, newaudio_length
-            if audio_length> self.n_pixels:
-                audio_signal = audio_signal[0:self.n_pixels]
-            # normalize
-            audio_signal = audio_signal / np.linalg.norm(audio_signal, np.inf)
             # plot the signal
-            self.signal_widget_list[item_index].my_plot(audio_signal,
-                                                    self.sample_rate[item_index],
-                                                    music_name1,
-                                                    self.color_tracks[item_index])
-            self.signal_widget_list[item_index].draw()
-
-            # print("audio_signal.shape", audio_signal.shape, "len_data", len_data)
-            # compute (and normalize) the transform of the audio signal
-            coeffs_audio, len_coeffs_audio = self.transform_audio(audio_signal, self.n_pixels)
-            # save coeffs_audio into the matrix
-            ma.append(coeffs_audio)
-            # align 2d-dwt coefficients of the image
-            self.dt_widget_list[item_index].axes.grid(True)
+            self.signal_widget_list[index].my_plot(result.audio_signals[index],
+                                                   result.sample_rate[index],
+                                                   music_name1,
+                                                   self.color_tracks[index])
+            self.signal_widget_list[index].draw()
 
+        elif stage == 'transform' and index >= 0:
+            music_name = os.path.splitext(item)
+            music_name=music_name[0]
+            music_name1=music_name.replace("-"," ")
             # plot the spectrum
-
-            if self.transform <= 1:
-                self.dt_widget_list[item_index].my_plot_dwt(coeffs_audio, music_name1,
-                                                        self.color_tracks[item_index])
+            coeffs_audio = result.coeffs_audio[index]
+            self.dt_widget_list[index].axes.grid(True)
+            if result.transform <= 1:
+                self.dt_widget_list[index].my_plot_dwt(coeffs_audio, music_name1,
+                                                       self.color_tracks[index])
             else:
-                self.dt_widget_list[item_index].my_plot_dft(coeffs_audio, music_name1,
-                                                        self.color_tracks[item_index],
-                                                        self.sample_rate[item_index])
-            self.dt_widget_list[item_index].draw()
-
-
-        # align 2d-dwt coefficients of the image
-        if self.transform == 1:
-            self.coeffs_image = self.align_dwt2_to_dwt1(coeffs_audio,
-                                                   len_coeffs_audio,
-                                                   self.coeffs_image,
-                                                   self.len_coeffs_image)
-        elif self.transform == 3:
-            self.coeffs_image = self.coeffs_image.flatten()
-
-        # plot the transform of the original image
-        if self.transform <= 1:
-            self.dt_widget_list[4].my_plot_dwt(self.coeffs_image,
-                                               "painting",
-                                               self.color_painting[0])
-        else:
-            self.dt_widget_list[4].my_plot_dft(self.coeffs_image,
-                                               "painting",
-                                               self.color_painting[0],
-                                               self.my_sample_rate)
-        self.dt_widget_list[4].draw()
-
-        # solve the least square problem
-        nmatrix = np.sum(len_coeffs_audio)
-
-        matrix = np.zeros([nmatrix, self.n_selected_tracks], dtype=complex)
-        for matrix_column, item in enumerate(ma):
-            matrix[:, matrix_column] = np.array(item, dtype=complex)
-            # matrix_column += 1
-        del ma
-        matrix = np.matrix(matrix)
-        a = np.matmul(matrix.H, matrix)
-        # align the size of coeffs_audio and coeffs_image (to the first one)
-        cis = self.coeffs_image.size
-        cas = coeffs_audio.size
-        if cis < cas:
-            self.coeffs_image = np.r_[self.coeffs_image, np.zeros([1, cas-cis])]
-        elif cis > cas:
-            self.coeffs_image = self.coeffs_image[0:cas]
-        c = np.matrix(self.coeffs_image)
-
-        b = np.matmul(matrix.H, c.T)
-        # alpha = a \ b
-        self.alpha = np.linalg.solve(a, b)
-        # print("alpha",self.alpha[0:4])
-
-        # reconstruct the painting signal
-        coeffs_projection = np.matmul(matrix, self.alpha)
-        del matrix
-
-        coeffs_projection = np.array(coeffs_projection).flatten()
-        coeffs_projection_real = coeffs_projection.real
-        if self.transform <= 1:
-            self.dt_widget_list[5].my_plot_dwt(coeffs_projection_real,
+                n = result.len_coeffs_audio
+                self.dt_widget_list[index].my_plot_dft(
+                    engine_module().dft_half_spectrum(coeffs_audio, n), music_name1,
+                    self.color_tracks[index], result.sample_rate[index], n)
+            self.dt_widget_list[index].draw()
+
+        elif stage == 'solve':
+            self.coeffs_image = result.coeffs_image
+            # plot the transform of the original image
+            if result.transform <= 1:
+                self.dt_widget_list[4].my_plot_dwt(self.coeffs_image,
+                                                   "painting",
+                                                   self.color_painting[0])
+            else:
+                n = result.len_coeffs_audio
+                self.dt_widget_list[4].my_plot_dft(
+                    engine_module().dft_half_spectrum(self.coeffs_image, n),
+                    "painting", self.color_painting[0], result.my_sample_rate, n)
+            self.dt_widget_list[4].draw()
+
+            # plot the transform of the new piece of music
+            if result.transform <= 1:
+                self.dt_widget_list[5].my_plot_dwt(result.coeffs_projection.real,
+                                                   "new piece of music",
+                                                   self.color_painting[1])
+            else:
+                n = result.len_coeffs_audio
+                self.dt_widget_list[5].my_plot_dft(
+                    engine_module().dft_half_spectrum(result.coeffs_projection, n).real,
+                    "new piece of music", self.color_painting[1], result.my_sample_rate, n)
+            self.dt_widget_list[5].draw()
+
+        elif stage == 'reconstruct':
+            # plot the signal of the image
+            self.signal_widget_list[5].my_plot(result.painting_signal,
+                                               result.my_sample_rate,
                                                "new piece of music",
                                                self.color_painting[1])
-        else:
-            self.dt_widget_list[5].my_plot_dft(coeffs_projection_real,
-                                               "new piece of music",
-                                               self.color_painting[1],
-                                               self.my_sample_rate)
-        self.dt_widget_list[5].draw()
-
-        # build the music track of the painting
-        painting_signal = self.reconstruct_audio_signal(coeffs_projection,
-                                                        len_coeffs_audio)
-        # plot the signal of the image
-        self.signal_widget_list[5].my_plot(painting_signal, self.my_sample_rate,
-                                           "new piece of music",
-                                           self.color_painting[1])
-        self.signal_widget_list[5].draw()
-
-        # save the trace of the new piece of music
-        soundfile.write("sound1.wav", painting_signal, self.my_sample_rate, format='WAV')
-
-        # connect the new piece of music to its play button
-        self.player_painting = Player(CURRENT_DIR, "sound1.wav")
+            self.signal_widget_list[5].draw()
+            if result.scale == 1:
+                # the new piece of music can be played at once
+                self.load_piece(result)
+
+    def load_piece(self, result):
+        # the new piece of music (in memory) in its player
+        self.result = result
+        self.piece_file = None
+        self.player_painting.set_signal(result.painting_signal, result.my_sample_rate)
         self.playbutton_painting.setEnabled(True)
-        self.playbutton_painting.clicked.connect(lambda: self.click_playbutton(
-            self.player_painting))
         self.pausebutton_painting.setEnabled(True)
-        self.pausebutton_painting.clicked.connect(lambda: self.click_pausebutton(
-            self.player_painting))
-
-        # connect the music track to its play button
-        if self.n_selected_tracks >0:
-            self.player_music0 = Player(self.music_dir, self.selected_tracks[0])
-            self.playbutton_music0.setEnabled(True)
-            self.playbutton_music0.clicked.connect(
-                lambda: self.click_playbutton(self.player_music0))
-            self.pausebutton_music0.setEnabled(True)
-            self.pausebutton_music0.clicked.connect(lambda: self.click_pausebutton(
-                self.player_music0))
-        if self.n_selected_tracks > 1:
-            self.player_music1 = Player(self.music_dir, self.selected_tracks[1])
-            self.playbutton_music1.setEnabled(True)
-            self.playbutton_music1.clicked.connect(
-                lambda: self.click_playbutton(self.player_music1))
-            self.pausebutton_music1.setEnabled(True)
-            self.pausebutton_music1.clicked.connect(lambda: self.click_pausebutton(
-                self.player_music1))
-        if self.n_selected_tracks > 2:
-            self.player_music2 = Player(self.music_dir, self.selected_tracks[2])
-            self.playbutton_music2.setEnabled(True)
-            self.playbutton_music2.clicked.connect(
-                lambda: self.click_playbutton(self.player_music2))
-            self.pausebutton_music2.setEnabled(True)
-            self.pausebutton_music2.clicked.connect(lambda: self.click_pausebutton(
-                self.player_music2))
-        if self.n_selected_tracks > 3:
-            self.player_music3 = Player(self.music_dir, self.selected_tracks[3])
-            self.playbutton_music3.setEnabled(True)
-            self.playbutton_music3.clicked.connect(
-                lambda: self.click_playbutton(self.player_music3))
-            self.pausebutton_music3.setEnabled(True)
-            self.pausebutton_music3.clicked.connect(lambda: self.click_pausebutton(
-                self.player_music3))
-
+        self.savebutton_painting.setEnabled(True)
+
+    def save_piece(self):
+        # save the new piece of music of the last analysis in a new file
+        # (the same file if it is saved again)
+        if self.result is None:
+            return
+        if self.piece_file is None:
+            self.piece_file = unique_output_file(self.painting_name)
+        engine_module().write_audio(self.piece_file, self.result.painting_signal,
+                                    self.result.my_sample_rate)
+        self.helpgobutton.setText("New piece of music saved in " + self.piece_file)
+
+    def elaboration_finished(self, result):
+        # slot called when the analysis is complete
+        self.worker = None
+        self.showing_preview = False
+        self.cancelbutton.hide()
+        self.scanbutton.setEnabled(True)
+        self.n_pixels = result.n_pixels
+        self.sample_rate = result.sample_rate
+
+        # the analysed music tracks in their players (usually already
+        # loaded by prepare_players)
+        self.load_players(result.track_files)
+        for k in range(len(result.track_files)):
+            self.playbuttons_music[k].setEnabled(True)
+            self.pausebuttons_music[k].setEnabled(True)
 
         # plot the piechart
-        self.alpha = abs(self.alpha)
-        self.alpha_percento =self.alpha/np.sum(self.alpha)
-        self.pie_widget.fill_pie(self.alpha_percento, self.selected_tracks, self.color_tracks)
+        self.alpha = result.alpha
+        self.alpha_percento = result.alpha_percento
+        self.pie_widget.clear_pie()
+        self.pie_widget.fill_pie(self.alpha_percento,
+                                 [os.path.basename(item) for item in result.track_files],
+                                 self.color_tracks)
 
-        # compute the distance between the normalized spectrum of the image and
+        # the distance between the normalized spectrum of the image and
         #  normalized spectrum of the projection
-        painting_spectrum_norm = np.linalg.norm(self.coeffs_image)
-        projection_spectrum_norm = np.linalg.norm(coeffs_projection)
-        normalized_distance =  np.linalg.norm(self.coeffs_image/painting_spectrum_norm-
-                                             coeffs_projection/projection_spectrum_norm)
-        self.distance_widget.fill_distances(normalized_distance)
-
-        # deactivate the go button
-        self.gobutton.setEnabled(False)
-        self.gobutton.setStyleSheet('QPushButton')
+        self.distance_widget.fill_distances(result.distance)
 
         # activate the clear button
         self.clearbutton.setEnabled(True)
@@ -1062,142 +1604,39 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.helpgobutton.setText("Click on the play buttons to listen to the sounds.")
         self.helpclearbutton.show()
-
-
-    def image_elaboration(self):
-        # read yhe image
-        data = PIL.Image.open(self.paintings_dir + self.painting_name + ".png")
-        # save the image intensity
-        image = np.array(data, dtype=np.double)
-        if image.shape[2] == 2:
-            self.image_intensity = image[:, :, 0]
-        elif image.shape[2] == 4:
-            self.image_intensity = (image[:, :, 0] + image[:, :, 1] + image[:, :, 2]) / 3
-
-        self.n_pixels = self.image_intensity.size
-
-        # compute the discrete transform of the image
-        self.coeffs_image, self.len_coeffs_image = self.transform_image(self.image_intensity)
-        #print("number of pixels", self.n_pixels)
-
-    def transform_image(self, image_intensity):
-        # transform the image
-
-        if self.transform == 0:
-            #  2d --> 1d --> DWT
-            x = image_intensity.flatten()
-            c = pywt.wavedec(x, wavelet=self.mother_wavelet,
-                             level=self.wave_nlevels)
-            # coeffs is a list
-            len_coeffs = []
-            coeffs = []
-            for item in c:
-                v = np.array(item)  # row vector
-                len_coeffs.append(v.size)
-                coeffs = np.r_[coeffs, v]  # concatenatepre-norm
-        elif self.transform == 1:
-            # 2d --> DWT --> 1d
-            c = pywt.wavedec2(image_intensity,
-                              wavelet=self.mother_wavelet,
-                              level=self.wave_nlevels)
-            len_coeffs = []
-            coeffs = []
-            i = 1
-            for item in c:
-                if i == 1:
-                    v = np.array(item)  # matrix
-                    v = v.flatten()
-                    len_coeffs.append(v.size)
-                    coeffs = np.r_[coeffs, v]  # concatenate
-                else:
-                    for subitem in item:
-                        v = np.array(subitem)  # matrix
-                        v = v.flatten()
-                        len_coeffs.append(v.size)
-                        coeffs = np.r_[coeffs, v]  # concatenate
-                i += 1
-        elif self.transform == 2:
-            #   2d --> 1d -->DFT
-            x = image_intensity.T.flatten()
-            coeffs = fft.fft(x)
-            len_coeffs = coeffs.size
-        elif self.transform == 3:
-            #   2d --> DFT --> 1d
-            coeffs = fft.fft2(image_intensity)
-            coeffs.flatten()
-            len_coeffs = coeffs.size
-
-        return coeffs, len_coeffs
-
-    def transform_audio(self, data, n_pixels):
-        # print('dtw_coeff.shape ', dtw_coeff.shape)
-        # pad the array with zero values
-        len_data = data.size
-        if n_pixels < len_data:
-            data = data[0:n_pixels]
-        elif n_pixels > len_data:
-            data = np.r_[data, np.zeros(n_pixels-len_data)]
-
-        if self.transform <= 1:
-            c = pywt.wavedec(data, wavelet=self.mother_wavelet,
-                             level=self.wave_nlevels)
-            # coeffs is a list
-            len_coeffs = []
-            coeffs = []
-            for item in c:
-                v = np.array(item)  # row vector
-                len_coeffs.append(v.size)
-                coeffs = np.r_[coeffs, v]  # concatenate
-        else:
-            coeffs = fft.fft(data)
-            len_coeffs = coeffs.size
-        return coeffs, len_coeffs
-
-    def align_dwt2_to_dwt1(self, coeffs_audio, len_coeffs_audio,
-                           coeffs_image, len_coeffs_image):
-        n = coeffs_audio.size
-        coeffs1 = np.zeros(n)
-        nci = len_coeffs_image[0]
-        nca = len_coeffs_audio[0]
-        nrep = nca // nci
-        krep = 0
-        coeffs1[krep*nci:krep*nci+nci] = coeffs_image[0:nci]
-        for krep in range(1,nrep):
-            # coeffs1[krep*nci:krep*nci+nci] = coeffs_image[0:nci]
-            coeffs1[krep*nci:krep*nci+nci] = np.zeros([nci])
-        na = nca
-        ni = nci
-        for l1 in range(self.wave_nlevels):
-            nci = len_coeffs_image[1+l1*3]
-            nca = len_coeffs_audio[1+l1]
-            nrep = nca // (nci*3)
-            hvd = coeffs_image[ni:ni+nci*3]
-            if nrep > 0:
-                krep = 0
-                coeffs1[na+krep*nci*3:na+krep*nci*3+nci*3] = hvd
-                for krep in range(1, nrep):
-                    # coeffs1[na+krep*nci*3:na+krep*nci*3+nci*3] = hvd
-                    coeffs1[na+krep*nci*3:na+krep*nci*3+nci*3] = np.zeros([len(hvd)])
-            else:
-                coeffs1[na:na+nca] = hvd[0:nca]
-            na = na + nca
-            ni = ni + nci*3
-        return coeffs1
-
-    def reconstruct_audio_signal(self, coeffs_projection, len_coeffs_audio):
-        if self.transform <= 1:
-            coeffs = []
-            index = 0
-            for item in len_coeffs_audio:
-                v = np.array(coeffs_projection[index:index+item])
-                coeffs.append(v)
-                index = index+item
-            x = pywt.waverec(coeffs, self.mother_wavelet)
-        else:
-            x = fft.ifft(coeffs_projection)
-        signal = x.real / np.linalg.norm(x.real, np.inf)
-        signal = signal.flatten()
-        return signal
+        self.stop_profiler(result)
+
+    def cancel_elaboration(self):
+        # ask the worker to stop at the end of the current stage
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancelbutton.setEnabled(False)
+            self.helpgobutton.setText("Cancelling the elaboration...")
+
+    def elaboration_stopped(self):
+        # slot called when the analysis has been cancelled:
+        # clear the partial output and activate the go button again
+        self.worker = None
+        self.discard_profiler()
+        self.full_engine = None
+        self.showing_preview = False
+        self.cancelbutton.hide()
+        self.cancelbutton.setEnabled(True)
+        self.scanbutton.setEnabled(True)
+        self.clear_all()
+        self.activate_gobutton()
+
+    def elaboration_failed(self, message):
+        # slot called when the analysis raised an error
+        self.elaboration_stopped()
+        self.helpgobutton.setText("Error: " + message)
+
+    def closeEvent(self, event):
+        # stop the running analysis before closing the window
+        if self.worker is not None:
+            self.worker.cancel()
+            QtCore.QThreadPool.globalInstance().waitForDone()
+        super().closeEvent(event)
 
 
     def click_playbutton(self, player):
@@ -1213,50 +1652,109 @@ class MainWindow(QtWidgets.QMainWindow):
             playbutton.setIconSize(QtCore.QSize(30, 30))
 
 
-def generate_small_images(paintings_dir, paintings_list_filename):
-
-# read the list of filenames
-    with open(paintings_list_filename, "r") as input_file:
-        menu_csv = list(csv.reader(input_file, delimiter="\n"))
-    menu_csv1 = []
-    for sublist in menu_csv:
-        for item in sublist:
-            menu_csv1.append(item)
-
-# create the directory "./_small"
-    paintings_dir_small = "./_small/"
-    Path(paintings_dir_small).mkdir(parents=True, exist_ok=True)
-
-#
-    for img in menu_csv1[1:]:
-        if not exists(img+"_small.png"):
-            im1 = Image.open(paintings_dir + img + ".png")
-            if im1.height >= im1.width:
-                new_h = 200
-                new_w = int(im1.width *200/im1.height)
-            else:
-                new_w = 200
-                new_h = int(im1.height * 200 / im1.width)
-            im1 = im1.resize((new_w, new_h), Image.ANTIALIAS)
-            im1.save(paintings_dir_small + img + "_small.png", optimize = True, quality = 95)
-
-
-app = QtWidgets.QApplication(sys.argv)
-# directory where the audio-files are stored (absolute path)
-music_dir = "/home/gerva/Music/"
-# csv file with the list of mp3 files of the music tracks
-music_list_filename = "musictracks.csv"
-# directory where the images are stored  (absolute or relative path)
-paintings_dir = "../Paintings/"
-# csv file with the list of images (without extension).
-# The first line of the file must be blank or must contain any other string, like e.g. '----'
-paintings_list_filename = "paintings.csv"
-
-# generate small_size images
-generate_small_images(paintings_dir, paintings_list_filename)
-
-warnings.filterwarnings('ignore')
-window = MainWindow(music_dir, music_list_filename,
-                    paintings_dir, paintings_list_filename)
-window.show()
-app.exec_()
+class EngineWarmUpWorker(QtCore.QRunnable):
+    # import the numerical kernel in background, while the user
+    # chooses the painting and the music tracks
+    def run(self):
+        try:
+            engine_module()
+        except Exception as error:
+            # the error is raised again when Go is pressed
+            print("WARNING: the numerical kernel cannot be imported:", error)
+
+
+def report_startup_time(app, window_shown):
+    # --startup-time: print the time needed to show the window,
+    # then the time of the deferred imports, and quit
+    window_ready = time.perf_counter()
+    print("imports:      {:8.3f} s".format(IMPORT_END - IMPORT_START))
+    print("window shown: {:8.3f} s".format(window_shown - IMPORT_START))
+    print("window ready: {:8.3f} s".format(window_ready - IMPORT_START))
+    engine_module()
+    print("deferred imports (in background): {:8.3f} s".format(
+        time.perf_counter() - window_ready))
+    app.quit()
+
+
+class ThumbnailSignals(QtCore.QObject):
+    # the name of the painting whose small image has been saved (or not)
+    ready = QtCore.Signal(str)
+    failed = QtCore.Signal(str)
+
+
+class ThumbnailWorker(QtCore.QRunnable):
+    # generate the small image of a painting (see PlayingPaintingsThumbnails.py)
+    # without blocking the window
+    def __init__(self, paintings_dir, name):
+        super().__init__()
+        self.paintings_dir = paintings_dir
+        self.name = name
+        self.signals = ThumbnailSignals()
+
+    def run(self):
+        try:
+            make_small_image(self.paintings_dir, self.name)
+        except Exception as error:
+            print("WARNING: the small image of " + self.name +
+                  " cannot be generated:", error)
+            self.signals.failed.emit(self.name)
+        else:
+            self.signals.ready.emit(self.name)
+
+
+# the end of the imports (see --startup-time below)
+IMPORT_END = time.perf_counter()
+
+
+if __name__ == "__main__":
+    # python PlayingPaintings.py --startup-time
+    # prints the time from the imports to the first event loop iteration
+    # with the window shown (the time spent by python itself before the
+    # imports is not included: see python -X importtime), and quits
+    measure_startup = "--startup-time" in sys.argv
+    if measure_startup:
+        sys.argv.remove("--startup-time")
+    # python PlayingPaintings.py --profile [--profile-memory] [--profile-log LOG]
+    # shows the time and the memory of the stages of each run in the status bar
+    # (see PlayingPaintingsProfiler.py), and appends them to LOG as json lines
+    profile = "--profile" in sys.argv
+    if profile:
+        sys.argv.remove("--profile")
+    trace_memory = "--profile-memory" in sys.argv
+    if trace_memory:
+        sys.argv.remove("--profile-memory")
+    profile_log = None
+    if "--profile-log" in sys.argv[:-1]:
+        k = sys.argv.index("--profile-log")
+        profile_log = sys.argv[k + 1]
+        del sys.argv[k:k + 2]
+
+    app = QtWidgets.QApplication(sys.argv)
+    # directory where the audio-files are stored (absolute path)
+    music_dir = "/home/gerva/Music/"
+    # csv file with the list of mp3 files of the music tracks
+    music_list_filename = "musictracks.csv"
+    # directory where the images are stored  (absolute or relative path)
+    paintings_dir = "../Paintings/"
+    # csv file with the list of images (without extension).
+    # The first line of the file must be blank or must contain any other string, like e.g. '----'
+    paintings_list_filename = "paintings.csv"
+
+    warnings.filterwarnings('ignore')
+    window = MainWindow(music_dir, music_list_filename,
+                        paintings_dir, paintings_list_filename,
+                        profile=profile, trace_memory=trace_memory,
+                        profile_log=profile_log)
+    window.show()
+    window_shown = time.perf_counter()
+    # the small images of the paintings are generated when they are selected
+    # the first time (see also PlayingPaintingsThumbnails.py)
+
+    if measure_startup:
+        QtCore.QTimer.singleShot(0, lambda: report_startup_time(app, window_shown))
+    else:
+        # import the numerical kernel once the window is on screen
+        QtCore.QTimer.singleShot(0, lambda: QtCore.QThreadPool.globalInstance().start(
+            EngineWarmUpWorker()))
+
+    app.exec_()
@@ -0,0 +1,378 @@
+############################################################################
+# Project: PlayingPaintings
+# Author: Paola Gervasio
+# https://github.com/pgerva/playing-paintings
+#
+# To cite this project: P. Gervasio, A. Quarteroni, D. Cassani.
+#            Let the paintings play. (2022)
+#            https://arxiv.org/abs/2206.14142
+#
+#  Copyright (C) 2022 by Paola Gervasio.
+#
+#   PlayingPaintings is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   PlayingPaintings is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with PlayingPaintings.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ####################################################################
+#
+# Benchmark of the stages of the analysis (see PlayingPaintingsEngine.py),
+# on synthetic paintings (png) and music tracks (wav), so that it does not
+# need any real painting or music track:
+#
+#   python PlayingPaintingsBenchmark.py --output results.json
+#   python PlayingPaintingsBenchmark.py --output new.json --compare results.json
+#
+# The synthetic files are generated once in ./_benchmark/ (see --data-dir).
+# The results are saved in a json file; --compare prints the ratio between
+# the times of the stages of this run and of a previous one.
+#
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import warnings
+import contextlib
+import io
+import traceback
+import numpy as np # pip install numpy
+
+import scipy # pip install scipy
+import pywt  # pip install PyWavelets
+import soundfile # pip install soundfile
+import PIL  # pip install Pillow
+from PIL import Image
+
+from PlayingPaintingsEngine import PlayingPaintingsEngine, TRANSFORMS, WAVELETS
+
+# the stages, in the order of the analysis
+BENCHMARK_STAGES = ['image load', 'transform_image', 'track decode', 'transform_audio',
+                    'align', 'solve', 'reconstruct_audio_signal', 'wav write']
+# the settings of a whole run: only the runs with the same settings are compared
+BENCHMARK_SETTINGS = ['fast_length', 'single_precision']
+
+# the default synthetic inputs
+PAINTING_SIZES = ['256x256', '640x480', '1024x1024']
+PAINTING_MODES = ['L', 'LA', 'RGB', 'RGBA', 'I;16']
+TRACK_RATES = [22050, 44100]
+TRACK_DURATIONS = [10., 30.]
+N_TRACKS = 4
+
+
+def painting_filename(data_dir, size, mode):
+    return os.path.join(data_dir, "painting_{}_{}.png".format(size, mode))
+
+
+def track_filename(data_dir, sample_rate, duration, k):
+    return os.path.join(data_dir, "track_{}Hz_{:g}s_{}.wav".format(sample_rate, duration, k))
+
+
+def make_painting(filename, size, mode, seed=0):
+    # a synthetic painting: smooth color fields, a few edges and some noise,
+    # so that the transforms are neither trivial nor pure noise
+    width, height = [int(item) for item in size.split('x')]
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width] / max(width, height)
+    channels = []
+    for k in range(4):
+        fx, fy, phase = rng.uniform(1, 8, 3)
+        channel = 0.5 + 0.3 * np.sin(2 * np.pi * (fx * x + phase)) * np.cos(2 * np.pi * fy * y)
+        channel += 0.2 * ((x - 0.5) ** 2 + (y - 0.5) ** 2 < rng.uniform(0.01, 0.1))
+        channel += 0.05 * rng.standard_normal((height, width))
+        channels.append(np.clip(255 * channel, 0, 255).astype(np.uint8))
+    if mode == 'I;16':
+        # 16-bit grayscale
+        Image.fromarray(channels[0].astype(np.uint16) * 257).save(filename)
+        return
+    if mode == 'L':
+        data = channels[0]
+    else:
+        data = np.stack(channels[0:len(mode)], axis=2)
+    Image.fromarray(data, mode=mode).save(filename)
+
+
+def make_track(filename, sample_rate, duration, seed=0):
+    # a synthetic stereo music track: a few notes with their harmonics,
+    # an amplitude envelope and some noise
+    rng = np.random.default_rng(seed)
+    n_samples = int(sample_rate * duration)
+    t = np.arange(n_samples) / sample_rate
+    signal = np.zeros((n_samples, 2))
+    for note in range(6):
+        frequency = 110 * 2 ** (rng.integers(0, 36) / 12)
+        envelope = np.exp(-((t - rng.uniform(0, duration)) / rng.uniform(0.5, 3)) ** 2)
+        for harmonic in range(1, 4):
+            tone = envelope * np.sin(2 * np.pi * harmonic * frequency * t) / harmonic
+            signal[:, 0] += tone
+            signal[:, 1] += tone * rng.uniform(0.5, 1)
+    signal += 0.01 * rng.standard_normal(signal.shape)
+    signal /= np.amax(np.abs(signal))
+    soundfile.write(filename, 0.9 * signal, sample_rate, format='WAV')
+
+
+def generate_data(data_dir, sizes, modes, rates, durations, n_tracks=N_TRACKS):
+    # generate the synthetic files which are not in data_dir yet
+    os.makedirs(data_dir, exist_ok=True)
+    for size in sizes:
+        for mode in modes:
+            filename = painting_filename(data_dir, size, mode)
+            if not os.path.exists(filename):
+                make_painting(filename, size, mode)
+    for sample_rate in rates:
+        for duration in durations:
+            for k in range(n_tracks):
+                filename = track_filename(data_dir, sample_rate, duration, k)
+                if not os.path.exists(filename):
+                    make_track(filename, sample_rate, duration, seed=k + 1)
+
+
+def benchmark_case(painting_file, track_files, output_file, transform,
+                   mother_wavelet, wave_nlevels, fast_length=False,
+                   single_precision=False):
+    # run the stages of PlayingPaintingsEngine.run one after the other (on a
+    # single thread and without caches) and return the time of each stage
+    engine = PlayingPaintingsEngine(transform=transform, mother_wavelet=mother_wavelet,
+                                    wave_nlevels=wave_nlevels, n_workers=1,
+                                    fast_length=fast_length,
+                                    single_precision=single_precision)
+    times = dict.fromkeys(BENCHMARK_STAGES, 0.)
+
+    start = time.perf_counter()
+    engine.read_image(painting_file)
+    times['image load'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine.coeffs_image, engine.len_coeffs_image = engine.transform_image(engine.image_intensity)
+    times['transform_image'] = time.perf_counter() - start
+
+    coeffs_audio = []
+    for track_file in track_files:
+        start = time.perf_counter()
+        audio_signal, sample_rate = engine.read_audio(track_file, engine.n_pixels)
+        times['track decode'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        coeffs, len_coeffs_audio = engine.transform_audio(audio_signal, engine.n_pixels)
+        times['transform_audio'] += time.perf_counter() - start
+        coeffs_audio.append(coeffs)
+
+    # align_dwt2_to_dwt1 for DWT - full 2D
+    start = time.perf_counter()
+    coeffs_image = engine.align_coeffs_image(coeffs_audio[-1], len_coeffs_audio)
+    times['align'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    alpha, coeffs_image, coeffs_projection = engine.least_squares(coeffs_audio, coeffs_image)
+    times['solve'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    painting_signal = engine.reconstruct_audio_signal(coeffs_projection, len_coeffs_audio)
+    times['reconstruct_audio_signal'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine.write_audio(output_file, painting_signal)
+    times['wav write'] = time.perf_counter() - start
+
+    times['total'] = sum(times.values())
+    return engine.n_pixels, times
+
+
+def run_benchmark(args):
+    # all the combinations of the inputs; the wavelet and the levels
+    # matter only for the DWT transforms
+    generate_data(args.data_dir, args.sizes, args.modes, args.rates, args.durations)
+    output_file = os.path.join(args.data_dir, "_output.wav")
+    cases = []
+    for size in args.sizes:
+        for mode in args.modes:
+            for sample_rate in args.rates:
+                for duration in args.durations:
+                    for transform in args.transforms:
+                        wavelets = args.wavelets if transform <= 1 else [None]
+                        for mother_wavelet in wavelets:
+                            cases.append((size, mode, sample_rate, duration,
+                                          transform, mother_wavelet))
+
+    results = []
+    for n_case, (size, mode, sample_rate, duration, transform, mother_wavelet) in enumerate(cases):
+        painting_file = painting_filename(args.data_dir, size, mode)
+        track_files = [track_filename(args.data_dir, sample_rate, duration, k)
+                       for k in range(N_TRACKS)]
+        result = {
+            'painting': {'size': size, 'mode': mode},
+            'tracks': {'sample_rate': sample_rate, 'duration': duration,
+                       'n_tracks': N_TRACKS},
+            'transform': transform,
+            'wavelet': mother_wavelet,
+            'levels': args.levels if transform <= 1 else None,
+        }
+        try:
+            # the best of args.repeat runs of each stage
+            best = None
+            for k in range(args.repeat):
+                # the warnings of the engine (e.g. the tracks are too short) are not printed
+                with contextlib.redirect_stdout(io.StringIO()):
+                    n_pixels, times = benchmark_case(painting_file, track_files, output_file,
+                                                     transform, mother_wavelet or "db5",
+                                                     args.levels, args.fast_length,
+                                                     args.single_precision)
+                if best is None:
+                    best = times
+                else:
+                    best = {stage: min(best[stage], times[stage]) for stage in best}
+            result['n_pixels'] = n_pixels
+            result['times'] = best
+            status = "{:8.3f} s".format(best['total'])
+        except Exception as error:
+            # e.g. an image mode which the engine does not read
+            result['error'] = "".join(traceback.format_exception_only(type(error), error)).strip()
+            status = "error: " + result['error']
+        results.append(result)
+        print("[{}/{}] {} {} {}Hz {:g}s {} {}: {}".format(
+            n_case + 1, len(cases), size, mode, sample_rate, duration,
+            TRANSFORMS[transform], mother_wavelet or "", status))
+
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    return {
+        'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'machine': {
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'pywt': pywt.__version__,
+            'soundfile': soundfile.__version__,
+            'pillow': PIL.__version__,
+        },
+        'repeat': args.repeat,
+        'fast_length': args.fast_length,
+        'single_precision': args.single_precision,
+        'stages': BENCHMARK_STAGES,
+        'results': results,
+    }
+
+
+def case_key(result, benchmark):
+    # the case of a result of the benchmark, with the settings of its run
+    # (the runs saved before these settings existed had them off)
+    return (result['painting']['size'], result['painting']['mode'],
+            result['tracks']['sample_rate'], result['tracks']['duration'],
+            result['transform'], result['wavelet'], result['levels']) + \
+        tuple(benchmark.get(setting, False) for setting in BENCHMARK_SETTINGS)
+
+
+def settings_mismatch(new, old):
+    # the settings which differ between two runs of the benchmark
+    return [setting for setting in BENCHMARK_SETTINGS
+            if new.get(setting, False) != old.get(setting, False)]
+
+
+def compare_benchmarks(new, old, threshold=1.2):
+    # print the ratio new/old of the time of each stage for the cases of
+    # both runs; the stages slower than threshold times are marked.
+    # Return the number of regressions.
+    old_results = {case_key(result, old): result for result in old['results']
+                   if 'times' in result}
+    n_regressions = 0
+    for result in new['results']:
+        key = case_key(result, new)
+        if 'times' not in result or key not in old_results:
+            continue
+        old_times = old_results[key]['times']
+        ratios = []
+        for stage in BENCHMARK_STAGES + ['total']:
+            if old_times.get(stage, 0) <= 0 or stage not in result['times']:
+                continue
+            ratio = result['times'][stage] / old_times[stage]
+            # the stages below 1 ms are not significant
+            regression = ratio > threshold and result['times'][stage] > 1e-3
+            n_regressions += regression
+            ratios.append("{}={:.2f}{}".format(stage, ratio, "(!)" if regression else ""))
+        print("{} {} {}Hz {:g}s {} {}:".format(
+            key[0], key[1], key[2], key[3], TRANSFORMS[key[4]], key[5] or ""))
+        print("    " + " ".join(ratios))
+    print("{} stages slower than {:g} times the previous run".format(n_regressions, threshold))
+    return n_regressions
+
+
+def main(argv=None):
+    # command line entry point
+    parser = argparse.ArgumentParser(
+        description="Playing paintings: benchmark of the stages of the analysis "
+                    "on synthetic paintings and music tracks.")
+    parser.add_argument("--sizes", nargs="+", default=PAINTING_SIZES,
+                        help="sizes of the paintings, WIDTHxHEIGHT "
+                             "(default " + " ".join(PAINTING_SIZES) + ")")
+    parser.add_argument("--modes", nargs="+", default=PAINTING_MODES,
+                        choices=PAINTING_MODES,
+                        help="image modes of the paintings (default all)")
+    parser.add_argument("--rates", nargs="+", type=int, default=TRACK_RATES,
+                        help="sample rates of the music tracks "
+                             "(default " + " ".join(str(item) for item in TRACK_RATES) + ")")
+    parser.add_argument("--durations", nargs="+", type=float, default=TRACK_DURATIONS,
+                        help="durations of the music tracks, in seconds "
+                             "(default " + " ".join("{:g}".format(item) for item in TRACK_DURATIONS) + ")")
+    parser.add_argument("-t", "--transforms", nargs="+", type=int,
+                        default=list(range(len(TRANSFORMS))),
+                        choices=range(len(TRANSFORMS)),
+                        help="transforms (default all, see PlayingPaintingsEngine.py)")
+    parser.add_argument("-w", "--wavelets", nargs="+", default=WAVELETS, choices=WAVELETS,
+                        help="mother wavelets of the DWT transforms (default all)")
+    parser.add_argument("-l", "--levels", type=int, default=8,
+                        help="number of levels of the DWT transforms (default 8)")
+    parser.add_argument("--fast-length", action="store_true",
+                        help="pad the signals of DFT 1D unrolling to a length "
+                             "which is transformed fast")
+    parser.add_argument("--single-precision", action="store_true",
+                        help="run the analysis in single precision")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="the best time of REPEAT runs is saved (default 3)")
+    parser.add_argument("--data-dir", default="./_benchmark/",
+                        help="directory of the synthetic files (default ./_benchmark/)")
+    parser.add_argument("-o", "--output", default="benchmark.json",
+                        help="json file of the results (default benchmark.json)")
+    parser.add_argument("--compare", default=None, metavar="JSON",
+                        help="json file of a previous run, to compare with")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="a stage slower than THRESHOLD times the previous run "
+                             "is a regression (default 1.2)")
+    args = parser.parse_args(argv)
+
+    old = None
+    if args.compare is not None:
+        with open(args.compare, "r") as input_file:
+            old = json.load(input_file)
+        mismatch = settings_mismatch(vars(args), old)
+        if mismatch:
+            parser.error("the settings of {} differ from the ones of this run: {}".format(
+                args.compare, ", ".join(mismatch)))
+
+    # pywt warns when the levels are too many for the smallest inputs
+    warnings.filterwarnings('ignore')
+    benchmark = run_benchmark(args)
+    with open(args.output, "w") as output_file:
+        json.dump(benchmark, output_file, indent=1)
+    print("results saved in", args.output)
+
+    if old is not None:
+        if compare_benchmarks(benchmark, old, args.threshold) > 0:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
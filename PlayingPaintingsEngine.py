@@ -0,0 +1,1419 @@
+############################################################################
+# Project: PlayingPaintings
+# Author: Paola Gervasio
+# https://github.com/pgerva/playing-paintings
+#
+# To cite this project: P. Gervasio, A. Quarteroni, D. Cassani.
+#            Let the paintings play. (2022)
+#            https://arxiv.org/abs/2206.14142
+#
+#  Copyright (C) 2022 by Paola Gervasio.
+#
+#   PlayingPaintings is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   PlayingPaintings is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with PlayingPaintings.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ####################################################################
+#
+# The numerical kernel of PlayingPaintings, without any graphical user
+# interface. It can be used by the app (PlayingPaintings.py) or from the
+# command line:
+#
+#   python PlayingPaintingsEngine.py painting.png track1.mp3 track2.mp3 \
+#          --transform 0 --wavelet db5 --levels 8 --output sound1.wav
+#
+
+import os
+import sys
+import glob
+import json
+import hashlib
+import csv
+import argparse
+import threading
+import functools
+import itertools
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np # pip install numpy
+
+from scipy import fft
+import pywt  # pip install PyWavelets
+import soundfile # pip install soundfile
+import PIL.Image  # pip install Pillow
+from os.path import exists
+
+from PlayingPaintingsProfiler import StageProfiler
+from PlayingPaintingsSolver import design_matrix, solve_least_squares, \
+    solve_normal_equations, forward_selection, cosine_to_distance, gram_solve, \
+    gram_forward_selection, BLOCK_ROWS
+
+# the discrete transforms, in the order of the radio buttons of the app
+TRANSFORMS = ['DWT - 1D unrolling', 'DWT - full 2D',
+              'DFT - 1D unrolling', 'DFT - full 2D']
+# the mother wavelets available in the app
+WAVELETS = ['Haar', 'db3', 'db5', 'sym8', 'bior5.5']
+
+
+# the stages of the analysis, in the order they are reported by
+# PlayingPaintingsEngine.run to its progress callback
+STAGES = ['decode', 'transform', 'solve', 'reconstruct', 'write']
+# the stages of PlayingPaintingsEngine.scan_library
+SCAN_STAGES = ['decode', 'transform', 'scan', 'solve']
+
+# the number of pixels of the reduced painting of a preview (see
+# PlayingPaintingsEngine.preview_engine)
+PREVIEW_PIXELS = 2**16
+
+# the modes of the paintings read by image_intensity (see intensity_mode)
+INTENSITY_MODES = ['L', 'LA', 'RGB', 'RGBA', 'I']
+
+
+class AnalysisCancelled(Exception):
+    # raised by PlayingPaintingsEngine.run when the analysis is cancelled
+    pass
+
+
+def read_list(list_filename):
+    # read the list of files (one for each line) from a csv file
+    with open(list_filename, "r") as input_file:
+        menu_csv = list(csv.reader(input_file, delimiter="\n"))
+    menu_csv1 = []
+    for sublist in menu_csv:
+        for item in sublist:
+            menu_csv1.append(item)
+    return menu_csv1
+
+
+def decode_audio(track_file, n_samples=None):
+    # decode the music track (only its first n_samples samples, if given)
+    # and mix it down to a single float32 trace.
+    # soundfile reads just the requested frames; the formats it does not
+    # support are decoded by librosa (audioread) up to the needed duration.
+    try:
+        with soundfile.SoundFile(track_file) as sound_file:
+            sample_rate = sound_file.samplerate
+            frames = -1 if n_samples is None else n_samples
+            audio_signal = sound_file.read(frames=frames, dtype='float32',
+                                           always_2d=True).T
+    except RuntimeError:
+        # librosa (with numba) takes seconds to import: it is imported only
+        # when it is needed
+        import librosa # pip install librosa
+        duration = None
+        if n_samples is not None:
+            # one more sample, against the rounding of the duration
+            duration = (n_samples + 1) / librosa.get_samplerate(track_file)
+        audio_signal, sample_rate = librosa.load(track_file, sr=None, mono=False,
+                                                 duration=duration)
+    if n_samples is not None:
+        audio_signal = audio_signal[..., 0:n_samples]
+
+    # if the music track has more than one trace, average the first two
+    if audio_signal.shape.__len__() > 1:
+        if audio_signal.shape[0] > 1:
+            audio_signal = (audio_signal[0] + audio_signal[1]) / 2
+        else:
+            audio_signal = audio_signal[0]
+    return audio_signal.astype(np.float32, copy=False), sample_rate
+
+
+def painting_size(painting_file):
+    # the (width, height) of the painting: only the header of the file is read
+    with PIL.Image.open(painting_file) as data:
+        return data.size
+
+
+def intensity_mode(data):
+    # the painting in one of the modes handled by image_intensity:
+    # palette, bilevel and the other color modes are converted by Pillow,
+    # 16-bit grayscale is widened to 32-bit integers (so that it can be reduced)
+    if data.mode in INTENSITY_MODES:
+        return data
+    if data.mode.startswith('I;16'):
+        return data.convert('I')
+    if data.mode == 'P':
+        return data.convert('RGBA' if 'transparency' in data.info else 'RGB')
+    if data.mode in ('1', 'La'):
+        return data.convert('L')
+    if data.mode in ('PA', 'RGBa'):
+        return data.convert('RGBA')
+    return data.convert('RGB')
+
+
+def image_intensity(data, dtype=np.double, strip_pixels=2**20, out=None):
+    # the intensity of the painting (a Pillow image in one of INTENSITY_MODES)
+    # on the scale 0-255: the gray level, the gray level without the alpha
+    # channel, or the mean of the red, green and blue channels.
+    # The intensity is computed from the 8-bit buffer in strips of rows,
+    # so that only the 2D array of the result is allocated in dtype
+    # (or it is written in out, e.g. a memory-mapped array).
+    pixels = np.asarray(data)
+    intensity = out
+    if intensity is None:
+        intensity = np.empty(pixels.shape[0:2], dtype=dtype)
+    if data.mode == 'L':
+        intensity[...] = pixels
+    elif data.mode == 'LA':
+        intensity[...] = pixels[:, :, 0]
+    elif data.mode == 'I':
+        # 16-bit gray levels, brought to the scale of 8 bits
+        np.divide(pixels, 257, out=intensity, casting='unsafe')
+    else:
+        rows = max(strip_pixels // max(pixels.shape[1], 1), 1)
+        for start in range(0, pixels.shape[0], rows):
+            strip = pixels[start:start + rows, :, 0:3].sum(axis=2, dtype=np.uint16)
+            np.divide(strip, 3, out=intensity[start:start + rows], casting='unsafe')
+    return intensity
+
+
+def pack_coeffs(c, dtype=np.float64, new_array=np.empty):
+    # flatten the output of pywt.wavedec (list of arrays) or pywt.wavedec2
+    # (approximation, then a tuple of three detail matrices for each level)
+    # into one vector, allocated once by new_array(size, dtype); len_coeffs
+    # is the list of the sizes of the subbands, in the order they are stored.
+    subbands = []
+    for item in c:
+        if isinstance(item, tuple):
+            subbands.extend(item)
+        else:
+            subbands.append(item)
+    len_coeffs = [np.size(v) for v in subbands]
+    coeffs = new_array(sum(len_coeffs), dtype=dtype)
+    index = 0
+    for v, n in zip(subbands, len_coeffs):
+        coeffs[index:index+n] = np.ravel(v)
+        index = index+n
+    return coeffs, len_coeffs
+
+
+def unpack_coeffs(coeffs, len_coeffs):
+    # inverse of pack_coeffs for the 1D transform: the list of the
+    # subbands (views of coeffs), as needed by pywt.waverec
+    offsets = np.cumsum(len_coeffs)[:-1]
+    return np.split(coeffs[0:int(np.sum(len_coeffs))], offsets)
+
+
+def rfft_weights(n, dtype=np.float64):
+    # the square roots of the weights of the entries of the half spectrum
+    # (rfft) of a real signal of length n: all the entries but the first
+    # (and the last, for n even) stand also for their complex conjugate
+    weights = np.ones(n // 2 + 1, dtype=dtype)
+    weights[1:(n + 1) // 2] = np.sqrt(2)
+    return weights
+
+
+def pack_rfft(spectrum, n, dtype=np.float64):
+    # store the half spectrum of a real signal of length n as a real vector
+    # (real and imaginary parts interleaved), weighted so that the real
+    # inner products of these vectors are the inner products of the whole
+    # spectra: the least square problems of the DFT transforms become real.
+    # The vector has (at least) the precision of dtype.
+    spectrum = spectrum * rfft_weights(n, dtype)
+    return spectrum.view(spectrum.real.dtype)
+
+
+def unpack_rfft(coeffs, n):
+    # inverse of pack_rfft: the half spectrum
+    coeffs = np.ascontiguousarray(coeffs)
+    return coeffs.view(np.result_type(coeffs.dtype, np.complex64)) / rfft_weights(n, coeffs.dtype)
+
+
+def dft_half_spectrum(coeffs, n):
+    # the first n//2+1 entries of the DFT of length n, from the coefficients
+    # of a music track (pack_rfft) or of the image (DFT - full 2D: the real
+    # and the imaginary part are packed separately, see
+    # PlayingPaintingsEngine.transform_image), e.g. to plot them
+    if np.iscomplexobj(coeffs):
+        return unpack_rfft(coeffs.real, n) + 1j * unpack_rfft(coeffs.imag, n)
+    return unpack_rfft(coeffs, n)
+
+
+@functools.lru_cache(maxsize=64)
+def dwt2_to_dwt1_blocks(len_coeffs_audio, len_coeffs_image, n, wave_nlevels):
+    # the layout of PlayingPaintingsEngine.align_dwt2_to_dwt1, as a list of
+    # blocks (start in the aligned vector, start in coeffs_image, length).
+    # The index in coeffs_image of each entry of the aligned vector (-1: zero)
+    # is computed first, then the consecutive entries are merged in blocks.
+    index = np.full(n, -1, dtype=np.int64)
+    image_index = np.arange(sum(len_coeffs_image))
+    nci = len_coeffs_image[0]
+    nca = len_coeffs_audio[0]
+    # the approximation
+    index[0:nci] = image_index[0:nci]
+    na = nca
+    ni = nci
+    for l1 in range(wave_nlevels):
+        nci = len_coeffs_image[1+l1*3]
+        nca = len_coeffs_audio[1+l1]
+        # H, V, D of the level
+        hvd = image_index[ni:ni+nci*3]
+        if nca // (nci*3) > 0:
+            index[na:na+nci*3] = hvd
+        else:
+            index[na:na+nca] = hvd[0:nca]
+        na = na + nca
+        ni = ni + nci*3
+
+    # the blocks of consecutive entries of coeffs_image
+    written = np.flatnonzero(index >= 0)
+    if written.size == 0:
+        return ()
+    breaks = np.flatnonzero((np.diff(written) != 1) |
+                            (np.diff(index[written]) != 1)) + 1
+    starts = np.r_[0, breaks]
+    ends = np.r_[breaks, written.size]
+    return tuple((int(written[i]), int(index[written[i]]), int(j - i))
+                 for i, j in zip(starts, ends))
+
+
+def track_key(track_file):
+    # identify a music track by its path, its size and its modification time
+    path = os.path.realpath(track_file)
+    stat = os.stat(path)
+    path_key = hashlib.sha1(path.encode("utf-8")).hexdigest()[0:16]
+    stat_key = hashlib.sha1("{}-{}".format(stat.st_size, stat.st_mtime_ns)
+                            .encode("utf-8")).hexdigest()[0:16]
+    return path_key, stat_key
+
+
+class AudioCache:
+    # On-disk cache of the decoded music tracks.
+    # The mono trace of each track is saved as a float32 .npy file (with a
+    # .json file for its samplerate) whose name depends on the path, the size
+    # and the modification time of the track; later runs open it as a
+    # memory-mapped array instead of decoding the mp3 file again.
+    # If only the beginning of a track has been decoded, the entry is marked
+    # as incomplete and it is decoded again when more samples are needed.
+    def __init__(self, cache_dir="./_cache/audio/"):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def entry_name(self, track_file):
+        # <hash of the path>-<hash of size and mtime>
+        path_key, stat_key = track_key(track_file)
+        return path_key, path_key + "-" + stat_key
+
+    def load(self, track_file, n_samples=None):
+        # return the (memory-mapped) mono trace and the samplerate of the track:
+        # the whole track, or at least its first n_samples samples if given.
+        path_key, name = self.entry_name(track_file)
+        npy_file = os.path.join(self.cache_dir, name + ".npy")
+        json_file = os.path.join(self.cache_dir, name + ".json")
+        if exists(npy_file) and exists(json_file):
+            try:
+                # the .json file is written after the .npy file: read it first
+                with open(json_file, "r") as input_file:
+                    entry = json.load(input_file)
+                audio_signal = np.load(npy_file, mmap_mode="r")
+                if entry.get("complete", True) or (
+                        n_samples is not None and audio_signal.size >= n_samples):
+                    return audio_signal, entry["sample_rate"]
+            except (OSError, ValueError, KeyError):
+                # damaged entry: decode the track again
+                pass
+
+        audio_signal, sample_rate = decode_audio(track_file, n_samples)
+        complete = n_samples is None or audio_signal.size < n_samples
+
+        # remove the entries of the previous versions of the same file
+        for old_file in glob.glob(os.path.join(self.cache_dir, path_key + "-*")):
+            if not os.path.basename(old_file).startswith(name):
+                try:
+                    os.remove(old_file)
+                except OSError:
+                    pass
+        # write to temporary files and rename them, so that a concurrent
+        # thread or instance of the app never reads a half-written entry
+        tmp_name = os.path.join(self.cache_dir, name + ".{}-{}.tmp".format(
+            os.getpid(), threading.get_ident()))
+        with open(tmp_name, "wb") as output_file:
+            np.save(output_file, audio_signal)
+        os.replace(tmp_name, npy_file)
+        with open(tmp_name, "w") as output_file:
+            json.dump({"track": os.path.realpath(track_file),
+                       "sample_rate": sample_rate,
+                       "complete": complete}, output_file)
+        os.replace(tmp_name, json_file)
+        return audio_signal, sample_rate
+
+
+class CoefficientCache:
+    # In-memory LRU cache of the transforms of the music tracks.
+    # An entry (the coefficients and their lengths, as returned by
+    # PlayingPaintingsEngine.transform_audio) is identified by the key built by
+    # PlayingPaintingsEngine.coeffs_audio_key. When the entries exceed
+    # max_bytes, the least recently used ones are dropped. If spill_dir is
+    # given, every entry is also saved there (.npz) and reloaded from disk
+    # when it is not in memory anymore, e.g. in a later session.
+    def __init__(self, max_bytes=512*2**20, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        if self.spill_dir is not None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    def spill_file(self, key):
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.spill_dir, name + ".npz")
+
+    def get(self, key):
+        # return (coeffs, len_coeffs), or None if the entry is not cached
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        if self.spill_dir is None or not exists(self.spill_file(key)):
+            return None
+        try:
+            with np.load(self.spill_file(key)) as data:
+                coeffs = data["coeffs"]
+                len_coeffs = data["len_coeffs"].tolist()
+        except (OSError, ValueError, KeyError):
+            return None
+        self.store(key, coeffs, len_coeffs)
+        return coeffs, len_coeffs
+
+    def put(self, key, coeffs, len_coeffs):
+        self.store(key, coeffs, len_coeffs)
+        if self.spill_dir is not None and not exists(self.spill_file(key)):
+            tmp_name = self.spill_file(key) + ".{}-{}.tmp".format(
+                os.getpid(), threading.get_ident())
+            with open(tmp_name, "wb") as output_file:
+                np.savez(output_file, coeffs=coeffs, len_coeffs=np.array(len_coeffs))
+            os.replace(tmp_name, self.spill_file(key))
+
+    def store(self, key, coeffs, len_coeffs):
+        # the cached arrays are shared by all the runs: make them read-only
+        coeffs.setflags(write=False)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries[key][0].nbytes
+            self.entries[key] = (coeffs, len_coeffs)
+            self.entries.move_to_end(key)
+            self.nbytes += coeffs.nbytes
+            # evict the least recently used entries (but keep the last one)
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old_entry = self.entries.popitem(last=False)
+                self.nbytes -= old_entry[0].nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+class GramIndex:
+    # Index of a library of music tracks: for each configuration of the
+    # analysis (length, transform, wavelet, levels) the file
+    # <index_dir>/<hash of the configuration>.npz holds the Gram matrix of
+    # the tracks, i.e. the inner products of their coefficients (A^H A), and
+    # the keys of the tracks (see track_key). The norms of the tracks are the
+    # square roots of its diagonal. With the index, the least square problem
+    # for any subset of tracks needs only A^H c and a small k x k solve.
+    # The Gram matrix is computed in blocks of tracks which fit in max_bytes.
+    def __init__(self, index_dir="./_cache/gram/", max_bytes=1024*2**20):
+        self.index_dir = index_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.index_dir, exist_ok=True)
+
+    def index_file(self, config):
+        name = hashlib.sha1(repr(config).encode("utf-8")).hexdigest()[0:16]
+        return os.path.join(self.index_dir, name + ".npz")
+
+    def load(self, config):
+        # the keys and the Gram matrix saved for config (empty if none)
+        if exists(self.index_file(config)):
+            try:
+                with np.load(self.index_file(config)) as data:
+                    return list(data["keys"]), data["gram"]
+            except (OSError, ValueError, KeyError):
+                pass
+        return [], None
+
+    def save(self, config, keys, gram):
+        tmp_name = self.index_file(config) + ".{}-{}.tmp".format(
+            os.getpid(), threading.get_ident())
+        with open(tmp_name, "wb") as output_file:
+            np.savez(output_file, keys=np.array(keys), gram=gram)
+        os.replace(tmp_name, self.index_file(config))
+
+    def merge(self, old_keys, old_gram, keys, gram):
+        # the index old_keys, old_gram with the tracks keys (Gram matrix gram)
+        # added or updated. The old tracks which have changed on disk are
+        # dropped; the inner products between the other old tracks and the
+        # new ones are unknown (nan) until they are in the same scan.
+        new_keys = set(keys)
+        paths = set(key.split("-")[0] for key in keys)
+        merged_keys = [key for key in old_keys
+                       if key in new_keys or key.split("-")[0] not in paths]
+        kept = len(merged_keys)
+        kept_keys = set(merged_keys)
+        merged_keys += [key for key in dict.fromkeys(keys) if key not in kept_keys]
+        dtype = gram.dtype if old_gram is None else np.result_type(gram.dtype, old_gram.dtype)
+        merged = np.full([len(merged_keys), len(merged_keys)], np.nan, dtype=dtype)
+        if kept:
+            old_position = {key: position for position, key in enumerate(old_keys)}
+            positions = [old_position[key] for key in merged_keys[0:kept]]
+            merged[0:kept, 0:kept] = old_gram[np.ix_(positions, positions)]
+        merged_position = {key: position for position, key in enumerate(merged_keys)}
+        positions = [merged_position[key] for key in keys]
+        merged[np.ix_(positions, positions)] = gram
+        return merged_keys, merged
+
+    def gram_matrix(self, config, track_files, column):
+        # the Gram matrix of track_files (nan for the tracks which cannot be
+        # read). The entries of the tracks already in the index are reused;
+        # the others are computed by reading the coefficients of the tracks
+        # with column(index) (None if the track cannot be read) and added
+        # to the index, which keeps the tracks of the other scans.
+        keys = []
+        for item in track_files:
+            try:
+                keys.append("-".join(track_key(item)))
+            except OSError:
+                keys.append("")
+        n_tracks = len(keys)
+        old_keys, old_gram = self.load(config)
+        old_position = {key: position for position, key in enumerate(old_keys)}
+
+        dtype = np.float64 if old_gram is None else old_gram.dtype
+        gram = np.full([n_tracks, n_tracks], np.nan, dtype=complex)
+        known = [i for i in range(n_tracks) if keys[i] in old_position]
+        if known:
+            positions = [old_position[keys[i]] for i in known]
+            gram[np.ix_(known, known)] = old_gram[np.ix_(positions, positions)]
+        # the new tracks, and the ones whose inner products with some of
+        # the tracks are not in the index (they were never scanned together)
+        valid = [j for j in range(n_tracks) if keys[j] != ""]
+        new = [i for i in valid
+               if keys[i] not in old_position or np.isnan(gram[i, valid]).any()]
+
+        # blocks of new tracks: each block is kept in memory while all
+        # the tracks are read once
+        block_size = 1
+        pending = list(new)
+        while pending:
+            block = {}
+            while pending and len(block) < block_size:
+                i = pending.pop(0)
+                a = column(i) if keys[i] != "" else None
+                if a is None:
+                    keys[i] = ""
+                    continue
+                block[i] = a
+                dtype = np.result_type(dtype, a.dtype)
+                block_size = max(1, self.max_bytes // a.nbytes)
+            for j in range(n_tracks):
+                rows = [i for i in block if np.isnan(gram[i, j])]
+                if not rows or keys[j] == "":
+                    continue
+                a_j = block[j] if j in block else column(j)
+                if a_j is None:
+                    keys[j] = ""
+                    continue
+                for i in rows:
+                    gram[i, j] = np.vdot(block[i], a_j)
+                    gram[j, i] = np.conj(gram[i, j])
+        if not np.issubdtype(dtype, np.complexfloating):
+            gram = gram.real
+
+        # save the tracks which have been read
+        readable = [i for i in range(n_tracks)
+                    if keys[i] != "" and not np.isnan(gram[i, i])]
+        if new:
+            self.save(config, *self.merge(old_keys, old_gram, [keys[i] for i in readable],
+                                          gram[np.ix_(readable, readable)]))
+        return gram
+
+
+class AnalysisResult:
+    # container of the output of PlayingPaintingsEngine.run
+    def __init__(self):
+        self.painting_file = ""
+        self.track_files = []
+        self.transform = 0
+        self.n_pixels = 0
+        # > 1 for a preview: the painting has been reduced by scale on each side
+        self.scale = 1
+        # one item for each music track
+        self.audio_signals = []
+        self.sample_rate = []
+        self.coeffs_audio = []
+        self.len_coeffs_audio = []
+        # painting and new piece of music
+        self.coeffs_image = None
+        self.coeffs_projection = None
+        self.painting_signal = None
+        self.my_sample_rate = 44100
+        # weights of the music tracks and distance
+        self.alpha = None
+        self.alpha_percento = None
+        self.distance = 0.
+
+
+class ScanResult:
+    # container of the output of PlayingPaintingsEngine.scan_library
+    def __init__(self):
+        self.painting_file = ""
+        self.track_files = []
+        self.transform = 0
+        self.n_pixels = 0
+        # one item for each track of the library: normalized distance between
+        # the painting and its projection onto that single track (nan if the
+        # track could not be read) and the tracks sorted by distance
+        self.distances = []
+        self.ranking = []
+        # the best subset of tracks (indices in track_files), its weights
+        # and its normalized distance
+        self.best_subset = []
+        self.alpha = None
+        self.alpha_percento = None
+        self.distance = 0.
+
+
+class PlayingPaintingsEngine:
+    # GUI-free kernel of the app: read a painting and a set of music tracks,
+    # compute their discrete transforms, solve the least square problem and
+    # reconstruct the new piece of music.
+    # The decoded music tracks are kept in audio_cache (an AudioCache),
+    # their transforms in coeffs_cache (a CoefficientCache) and the inner
+    # products of the tracks of the library in gram_index (a GramIndex),
+    # if given. The music tracks are read and transformed by n_workers
+    # threads (default: one for each track, up to the number of cpus).
+    # If profiler (a StageProfiler, see PlayingPaintingsProfiler.py) is
+    # given, the time and the memory of each stage are recorded there.
+    # With fast_length, the signals of DFT - 1D unrolling are padded with
+    # zeros to a length with small prime factors (see fft_length).
+    # With scale > 1, the painting is reduced by scale on each side before
+    # the analysis (a quick preview, see preview_engine).
+    # With single_precision, the image, the coefficients, the matrix of the
+    # least square problem and the new piece of music are single precision
+    # (half the memory); the small k x k system is solved in double
+    # precision (see PlayingPaintingsSolver.solve_normal_equations). If the
+    # rounding errors of the single precision transforms are eps relative to
+    # the norm of the coefficients (eps ~ 1e-6), the weights of the tracks
+    # and the normalized distance drift from the double precision ones by
+    #     |delta alpha_percento| <= 2 eps cond(A)^2 / cos,
+    #     |delta distance| <= 2 eps / distance,
+    # where cond(A) is the condition number of the matrix of the (normalized)
+    # coefficients of the tracks and cos = 1 - distance^2 / 2 = |p| / |c| (p
+    # the projection of the coefficients c of the painting). These are worst
+    # cases: the rounding errors are mostly orthogonal to the tracks, and
+    # the drift is much smaller (see README.md).
+    # With memory_budget (bytes), the analysis runs out of core: the
+    # painting, the coefficients, the matrix of the least square problem and
+    # the projection are memory-mapped files in work_dir, the tracks are
+    # elaborated one at a time and the least square problem is solved by
+    # streaming blocks of rows of about memory_budget bytes (see
+    # PlayingPaintingsSolver.solve_normal_equations). Only the decoded
+    # painting and the transform of one signal at a time are in memory.
+    def __init__(self, transform=0, mother_wavelet="db5", wave_nlevels=8,
+                 my_sample_rate=44100, audio_cache=None, coeffs_cache=None,
+                 gram_index=None, n_workers=None, profiler=None, fast_length=False,
+                 scale=1, single_precision=False, memory_budget=None,
+                 work_dir="./_cache/work/"):
+        self.transform = transform
+        self.mother_wavelet = mother_wavelet
+        self.wave_nlevels = wave_nlevels
+        self.my_sample_rate = my_sample_rate
+        self.audio_cache = audio_cache
+        self.coeffs_cache = coeffs_cache
+        self.gram_index = gram_index
+        self.n_workers = n_workers
+        self.profiler = profiler
+        self.fast_length = fast_length
+        self.scale = scale
+        self.single_precision = single_precision
+        # the precision of the real arrays of the analysis
+        self.dtype = np.float32 if single_precision else np.float64
+        self.memory_budget = memory_budget
+        self.out_of_core = memory_budget is not None
+        self.work_dir = work_dir
+        # the files of the memory-mapped arrays which could not be removed
+        # when they were opened (see new_array)
+        self.work_files = []
+        self.work_counter = itertools.count()
+        if self.out_of_core:
+            os.makedirs(self.work_dir, exist_ok=True)
+
+        self.image_intensity = None
+        self.image_shape = None
+        self.n_pixels = 0
+        self.coeffs_image = None
+        self.len_coeffs_image = None
+        # the matrix of the least square problem, in the out-of-core mode
+        self.matrix = None
+
+    def run(self, painting_file, track_files, output_file=None,
+            progress=None, cancelled=None):
+        # the whole analysis: painting_file is the png of the painting,
+        # track_files is the list of mp3 (or wav) files of the music tracks.
+        # If output_file is given, the new piece of music is saved there.
+        # progress(stage, index, result) is called at the end of each stage
+        # (index is the index of the track, -1 for the painting and for the
+        # other stages); if cancelled() returns True, the analysis stops
+        # before the next stage by raising AnalysisCancelled.
+        result = AnalysisResult()
+        result.painting_file = painting_file
+        result.track_files = list(track_files)
+        result.transform = self.transform
+        result.my_sample_rate = self.my_sample_rate
+        result.scale = self.scale
+
+        # the tracks are elaborated by several threads: report one stage at a time
+        stage_lock = threading.Lock()
+
+        def stage_done(stage, index):
+            with stage_lock:
+                if progress is not None:
+                    progress(stage, index, result)
+                if cancelled is not None and cancelled():
+                    raise AnalysisCancelled()
+
+        def track_elaboration(item_index):
+            # read and transform a music track
+            item = track_files[item_index]
+            with self.profile('decode', item_index):
+                audio_signal, sample_rate = self.read_audio(item, self.n_pixels)
+            result.audio_signals[item_index] = audio_signal
+            result.sample_rate[item_index] = sample_rate
+            stage_done('decode', item_index)
+            with self.profile('transform', item_index):
+                coeffs_audio, len_coeffs_audio = self.cached_transform_audio(
+                    item, audio_signal, self.n_pixels)
+                if self.out_of_core:
+                    # the coefficients are stored in their column of the matrix
+                    coeffs_audio = self.matrix_column(item_index, n_tracks, coeffs_audio)
+            result.coeffs_audio[item_index] = coeffs_audio
+            result.len_coeffs_audio = len_coeffs_audio
+            stage_done('transform', item_index)
+
+        # read the image
+        self.remove_work_files()
+        self.matrix = None
+        with self.profile('decode'):
+            self.read_image(painting_file)
+        result.n_pixels = self.n_pixels
+        stage_done('decode', -1)
+
+        # transform the image while the music tracks are read and
+        # transformed by n_workers threads (one at a time out of core)
+        n_tracks = len(track_files)
+        result.audio_signals = [None] * n_tracks
+        result.sample_rate = [None] * n_tracks
+        result.coeffs_audio = [None] * n_tracks
+        n_workers = min(self.n_workers or os.cpu_count() or 1, n_tracks)
+        if self.out_of_core:
+            n_workers = 1
+        if n_workers <= 1:
+            with self.profile('transform'):
+                self.coeffs_image, self.len_coeffs_image = self.transform_image(
+                    self.image_intensity)
+            stage_done('transform', -1)
+            for item_index in range(n_tracks):
+                track_elaboration(item_index)
+        else:
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                futures = [executor.submit(track_elaboration, item_index)
+                           for item_index in range(n_tracks)]
+                try:
+                    with self.profile('transform'):
+                        self.coeffs_image, self.len_coeffs_image = self.transform_image(
+                            self.image_intensity)
+                    stage_done('transform', -1)
+                    # the results are gathered in the order of the tracks
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+        # align 2d-dwt coefficients of the image
+        with self.profile('align'):
+            coeffs_image = self.align_coeffs_image(result.coeffs_audio[-1],
+                                                   result.len_coeffs_audio)
+
+        # solve the least square problem
+        alpha, coeffs_image, coeffs_projection = self.least_squares(
+            result.coeffs_audio, coeffs_image, self.matrix)
+        result.coeffs_image = coeffs_image
+        result.coeffs_projection = coeffs_projection
+
+        # weights of the tracks and distance between the spectra
+        result.alpha = abs(alpha)
+        result.alpha_percento = result.alpha / np.sum(result.alpha)
+        with self.profile('distance'):
+            result.distance = self.normalized_distance(coeffs_image,
+                                                       coeffs_projection)
+        stage_done('solve', -1)
+
+        # build the music track of the painting
+        with self.profile('reconstruct'):
+            result.painting_signal = self.reconstruct_audio_signal(
+                coeffs_projection, result.len_coeffs_audio)
+        stage_done('reconstruct', -1)
+
+        if output_file is not None:
+            with self.profile('write'):
+                self.write_audio(output_file, result.painting_signal)
+            stage_done('write', -1)
+        return result
+
+    def scan_library(self, painting_file, track_files, n_best=4,
+                     progress=None, cancelled=None):
+        # compare the painting with every track of the library:
+        # rank the tracks one by one, then choose the best subset of n_best
+        # tracks by forward selection (see PlayingPaintingsSolver.py).
+        # progress and cancelled as in run, with the stages SCAN_STAGES
+        # ('scan' is reported for each track of each step of the selection).
+        result = ScanResult()
+        result.painting_file = painting_file
+        result.track_files = list(track_files)
+        result.transform = self.transform
+
+        def stage_done(stage, index):
+            if progress is not None:
+                progress(stage, index, result)
+            if cancelled is not None and cancelled():
+                raise AnalysisCancelled()
+
+        # read and transform the image
+        with self.profile('decode'):
+            self.read_image(painting_file)
+        result.n_pixels = self.n_pixels
+        stage_done('decode', -1)
+        with self.profile('transform'):
+            self.coeffs_image, self.len_coeffs_image = self.transform_image(
+                self.image_intensity)
+        stage_done('transform', -1)
+
+        layout = []
+        # the coefficients of the image (aligned) and A^H c for the tracks
+        coeffs_image = None
+        products = {}
+
+        def column(index):
+            # the coefficients of a track of the library, None if it cannot be read
+            try:
+                with self.profile('decode', index):
+                    audio_signal = self.read_audio(track_files[index], self.n_pixels)[0]
+                with self.profile('transform', index):
+                    coeffs_audio, len_coeffs_audio = self.cached_transform_audio(
+                        track_files[index], audio_signal, self.n_pixels)
+            except Exception as error:
+                print("WARNING: The music track " + os.path.basename(track_files[index]))
+                print("cannot be read:", error)
+                return None
+            if not layout:
+                layout.append(len_coeffs_audio)
+            if coeffs_image is not None:
+                products[index] = np.vdot(coeffs_audio, coeffs_image)
+            stage_done('scan', index)
+            return coeffs_audio
+
+        # align the coefficients of the image to the layout of the
+        # coefficients of the tracks (the same for all of them)
+        coeffs_audio = None
+        for index in range(len(track_files)):
+            coeffs_audio = column(index)
+            if coeffs_audio is not None:
+                break
+        if coeffs_audio is None:
+            raise ValueError("none of the music tracks can be read")
+        coeffs_image = self.align_coeffs_image(coeffs_audio, layout[0])
+        coeffs_image = self.align_size(coeffs_image, coeffs_audio.size)
+        products[index] = np.vdot(coeffs_audio, coeffs_image)
+        del coeffs_audio
+
+        if self.gram_index is None:
+            # forward selection: its first step ranks the single tracks
+            cosines, selected = forward_selection(column, len(track_files),
+                                                  coeffs_image, n_best)
+            result.distances = cosine_to_distance(cosines)
+            result.best_subset = selected
+
+            # weights and distance of the best subset
+            ma = [column(index) for index in selected]
+            alpha, coeffs_image, coeffs_projection = self.least_squares(ma, coeffs_image)
+            result.distance = self.normalized_distance(coeffs_image, coeffs_projection)
+        else:
+            # everything from the Gram matrix of the library and A^H c
+            gram = self.gram_index.gram_matrix(self.transform_config(self.n_pixels),
+                                               track_files, column)
+            b = np.full(len(track_files), np.nan,
+                        dtype=np.result_type(gram.dtype, coeffs_image.dtype))
+            for index in range(len(track_files)):
+                if np.isnan(gram[index, index]):
+                    continue
+                if index not in products:
+                    column(index)
+                if index in products:
+                    b[index] = products[index]
+            coeffs_image_norm = np.linalg.norm(coeffs_image)
+            cosines = np.abs(b) / (np.sqrt(np.abs(np.diag(gram))) * coeffs_image_norm)
+            result.distances = cosine_to_distance(cosines)
+            selected = gram_forward_selection(gram, b, n_best)
+            result.best_subset = selected
+            alpha, projection_norm2 = gram_solve(gram, b, selected)
+            result.distance = float(cosine_to_distance(
+                np.sqrt(projection_norm2) / coeffs_image_norm))
+
+        result.ranking = [int(index) for index in np.argsort(result.distances)
+                          if not np.isnan(result.distances[index])]
+        result.alpha = abs(alpha)
+        result.alpha_percento = result.alpha / np.sum(result.alpha)
+        stage_done('solve', -1)
+        return result
+
+    def preview_engine(self, painting_file, max_pixels=PREVIEW_PIXELS):
+        # an engine for a preview of the analysis of painting_file: the
+        # painting reduced to at most max_pixels pixels and as many samples
+        # of the music tracks (see read_audio), with the sample rates reduced
+        # accordingly. The reduction by 2^j on each side (4^j pixels) removes
+        # about j levels of the 2D DWT and 2j of the 1D DWT of DWT - 1D
+        # unrolling: the coarse levels of the preview correspond to the
+        # coarse levels of the full analysis.
+        # None if the painting is already small.
+        width, height = painting_size(painting_file)
+        n_pixels = width * height
+        if n_pixels <= max_pixels:
+            return None
+        scale = int(np.ceil(np.sqrt(n_pixels / max_pixels)))
+        removed_levels = int(np.log2(scale))
+        if self.transform == 0:
+            removed_levels = 2 * removed_levels
+        wave_nlevels = max(self.wave_nlevels - removed_levels, 1)
+        return PlayingPaintingsEngine(transform=self.transform,
+                                      mother_wavelet=self.mother_wavelet,
+                                      wave_nlevels=wave_nlevels,
+                                      my_sample_rate=max(self.my_sample_rate // scale**2, 1),
+                                      audio_cache=self.audio_cache,
+                                      coeffs_cache=self.coeffs_cache,
+                                      n_workers=self.n_workers,
+                                      fast_length=self.fast_length,
+                                      scale=scale,
+                                      single_precision=self.single_precision)
+
+    def profile(self, stage, index=-1):
+        # the context in which a stage runs: measured by the profiler, if any
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.stage(stage, index)
+
+    def image_elaboration(self, painting_file):
+        # read the image and compute its discrete transform
+        with self.profile('decode'):
+            self.read_image(painting_file)
+        with self.profile('transform'):
+            self.coeffs_image, self.len_coeffs_image = self.transform_image(
+                self.image_intensity)
+
+    def read_image(self, painting_file):
+        # read the image and save its intensity
+        with PIL.Image.open(painting_file) as data:
+            data = intensity_mode(data)
+            if self.scale > 1:
+                # the mean of each block of scale x scale pixels
+                data = data.reduce(self.scale)
+            out = None
+            if self.out_of_core:
+                out = self.new_array((data.height, data.width), self.dtype)
+            self.image_intensity = image_intensity(data, self.dtype, out=out)
+
+        self.image_shape = self.image_intensity.shape
+        self.n_pixels = self.image_intensity.size
+
+    def read_audio(self, track_file, n_pixels):
+        # read the music track (mixed down to a single trace) and
+        # cut (or replicate) it to n_pixels samples.
+        # For a preview (scale > 1) the track is read over the same span of
+        # the full analysis, and averaged over blocks of scale^2 samples.
+        decimation = self.scale ** 2
+        n_pixels = n_pixels * decimation
+        if self.audio_cache is not None:
+            audio_signal, sample_rate = self.audio_cache.load(track_file, n_pixels)
+        else:
+            audio_signal, sample_rate = decode_audio(track_file, n_pixels)
+        audio_length = len(audio_signal)
+
+        if audio_length < n_pixels:
+            # print a message if the music track is too short.
+            print("WARNING: The music track " + os.path.basename(track_file))
+            print("is too short compared with the dimension of the image")
+            print("number of image pixels: ", n_pixels)
+            print("number of music-track samples: ", audio_length)
+            print("The music-track will be replicated for the computation")
+            newaudio_length = audio_length
+            newaudio_signal = audio_signal
+            while newaudio_length < n_pixels:
+                newaudio_signal = np.concatenate((newaudio_signal, audio_signal),
+                                                 axis=None)
+                newaudio_length += audio_length
+            audio_signal = newaudio_signal
+            del newaudio_signal, newaudio_length
+        if audio_length > n_pixels:
+            audio_signal = audio_signal[0:n_pixels]
+        if decimation > 1:
+            audio_signal = np.reshape(audio_signal[0:n_pixels],
+                                      (n_pixels // decimation, decimation)).mean(axis=1)
+            sample_rate = sample_rate / decimation
+        # normalize
+        norm = np.linalg.norm(audio_signal, np.inf)
+        if self.out_of_core:
+            audio_signal = np.divide(audio_signal, norm,
+                                     out=self.new_array(audio_signal.shape, audio_signal.dtype))
+        else:
+            audio_signal = audio_signal / norm
+        return audio_signal, sample_rate
+
+    def transform_image(self, image_intensity):
+        # transform the image
+
+        if self.transform == 0:
+            #  2d --> 1d --> DWT
+            x = image_intensity.ravel()
+            c = pywt.wavedec(x, wavelet=self.mother_wavelet,
+                             level=self.wave_nlevels)
+            # c is a list: pack it into one vector
+            coeffs, len_coeffs = pack_coeffs(c, self.dtype, self.new_array)
+        elif self.transform == 1:
+            # 2d --> DWT --> 1d
+            c = pywt.wavedec2(image_intensity,
+                              wavelet=self.mother_wavelet,
+                              level=self.wave_nlevels)
+            # approximation matrix, then (H, V, D) for each level
+            coeffs, len_coeffs = pack_coeffs(c, self.dtype, self.new_array)
+        elif self.transform == 2:
+            #   2d --> 1d -->DFT
+            # (the input is real: only half of the spectrum is computed)
+            x = image_intensity.T.flatten()
+            len_coeffs = self.fft_length(image_intensity.shape)
+            coeffs = pack_rfft(fft.rfft(x, len_coeffs), len_coeffs, self.dtype)
+            if self.out_of_core:
+                coeffs = self.stored_array(coeffs)
+        elif self.transform == 3:
+            #   2d --> DFT --> 1d
+            coeffs, len_coeffs = self.dft2_coeffs(image_intensity)
+
+        return coeffs, len_coeffs
+
+    def transform_audio(self, data, n_pixels):
+        # pad the array with zero values
+        len_data = data.size
+        if n_pixels < len_data:
+            data = data[0:n_pixels]
+        elif n_pixels > len_data:
+            data = np.r_[data, np.zeros(n_pixels-len_data, dtype=self.dtype)]
+
+        if self.transform <= 1:
+            c = pywt.wavedec(data, wavelet=self.mother_wavelet,
+                             level=self.wave_nlevels)
+            # c is a list: pack it into one vector
+            coeffs, len_coeffs = pack_coeffs(c, self.dtype)
+        else:
+            # the half spectrum (the signal is real), see pack_rfft
+            len_coeffs = self.fft_length()
+            coeffs = pack_rfft(fft.rfft(data, len_coeffs), len_coeffs, self.dtype)
+        return coeffs, len_coeffs
+
+    def fft_length(self, image_shape=None):
+        # the length of the DFTs of the image and of the music tracks (the
+        # signals are padded with zeros): n_pixels, or with fast_length the
+        # next length which scipy.fft transforms fast (a product of small
+        # primes). Only for DFT - 1D unrolling: padding the sides of the image
+        # would change the 2D spectrum of DFT - full 2D, and its weights.
+        if image_shape is None:
+            image_shape = self.image_shape
+        if not self.fast_length or self.transform != 2:
+            return int(np.prod(image_shape))
+        return fft.next_fast_len(int(np.prod(image_shape)), real=True)
+
+    def dft2_coeffs(self, image_intensity):
+        # The 2D DFT X of the image (from its half, rfft2), flattened, is not
+        # the spectrum of a real signal, as the spectra of the music tracks
+        # are: it is split into its hermitian part S (the spectrum of a real
+        # signal) and its antihermitian part i Y (Y is the spectrum of a real
+        # signal too). S and i Y are orthogonal, and so are their projections
+        # onto the (hermitian) spectra of the tracks: the least square problem
+        # for X is the one for S (real part of alpha) plus the one for Y
+        # (imaginary part of alpha), with the same real matrix. The packed
+        # S and Y are returned as the real and imaginary part of coeffs.
+        shape = image_intensity.shape
+        n_columns = shape[1]
+        half = fft.rfft2(image_intensity)
+        n_half = half.shape[1]
+        x = np.empty(shape, dtype=half.dtype)
+        x[:, 0:n_half] = half
+        # X[r, c] = conj(X[-r, -c]) for the columns which rfft2 leaves out
+        x[0, n_half:] = np.conj(half[0, n_columns-n_half:0:-1])
+        x[1:, n_half:] = np.conj(half[:0:-1, n_columns-n_half:0:-1])
+        x = x.ravel()
+        n = x.size
+        m = n // 2 + 1
+        # X[n-k], conjugated, for the first half of the frequencies
+        x_conj = np.empty(m, dtype=x.dtype)
+        x_conj[0] = np.conj(x[0])
+        x_conj[1:] = np.conj(x[n-1:n-m:-1])
+        x = x[0:m]
+        # S = (X + conj(X[n-k])) / 2, Y = (X - conj(X[n-k])) / 2i, packed
+        weights = rfft_weights(n, self.dtype)
+        coeffs = self.new_array(2 * m, x.dtype)
+        spectrum = x + x_conj
+        spectrum *= 0.5 * weights
+        coeffs.real = spectrum.view(spectrum.real.dtype)
+        np.subtract(x, x_conj, out=spectrum)
+        spectrum *= -0.5j * weights
+        coeffs.imag = spectrum.view(spectrum.real.dtype)
+        return coeffs, n
+
+    def transform_config(self, n_pixels):
+        # the transform of a track depends only on the track and on these
+        # parameters (the DWT modes share the same 1D transform of the audio);
+        # the tracks of a preview are averaged (see read_audio)
+        preview = ('scale', self.scale) if self.scale > 1 else ()
+        if self.single_precision:
+            preview += ('single',)
+        if self.transform <= 1:
+            return (n_pixels, 'dwt', self.mother_wavelet, self.wave_nlevels) + preview
+        return (n_pixels, 'rfft', self.fft_length()) + preview
+
+    def coeffs_audio_key(self, track_file, n_pixels):
+        return track_key(track_file) + self.transform_config(n_pixels)
+
+    def cached_transform_audio(self, track_file, data, n_pixels):
+        # transform_audio, through the cache of the coefficients (if any;
+        # not out of core, where the coefficients do not fit in memory)
+        if self.coeffs_cache is None or self.out_of_core:
+            return self.transform_audio(data, n_pixels)
+        key = self.coeffs_audio_key(track_file, n_pixels)
+        entry = self.coeffs_cache.get(key)
+        if entry is None:
+            entry = self.transform_audio(data, n_pixels)
+            self.coeffs_cache.put(key, entry[0], entry[1])
+        return entry
+
+    def align_coeffs_image(self, coeffs_audio, len_coeffs_audio):
+        # bring the coefficients of the image in the same layout
+        # of the (1D) coefficients of the audio signals
+        if self.transform == 1:
+            self.coeffs_image = self.align_dwt2_to_dwt1(coeffs_audio,
+                                                        len_coeffs_audio,
+                                                        self.coeffs_image,
+                                                        self.len_coeffs_image)
+        return self.coeffs_image
+
+    def align_dwt2_to_dwt1(self, coeffs_audio, len_coeffs_audio,
+                           coeffs_image, len_coeffs_image):
+        # put the subbands of the 2D DWT of the image where the subbands of
+        # the same level are in the 1D DWT of the audio: the approximation,
+        # then H, V, D of each level (cut to the size of the audio subband
+        # if they do not fit), the rest is zero.
+        # The layout is computed once for each size of the image and of the
+        # audio (see dwt2_to_dwt1_blocks), then the subbands are copied.
+        blocks = dwt2_to_dwt1_blocks(tuple(len_coeffs_audio), tuple(len_coeffs_image),
+                                     coeffs_audio.size, self.wave_nlevels)
+        coeffs1 = self.new_array(coeffs_audio.size, coeffs_image.dtype)
+        coeffs1[...] = 0
+        for start1, start, length in blocks:
+            coeffs1[start1:start1+length] = coeffs_image[start:start+length]
+        return coeffs1
+
+    def align_size(self, coeffs_image, nmatrix):
+        # align the size of coeffs_image to the size of coeffs_audio
+        cis = coeffs_image.size
+        if cis < nmatrix:
+            coeffs_image = np.r_[coeffs_image, np.zeros(nmatrix-cis, dtype=coeffs_image.dtype)]
+        elif cis > nmatrix:
+            coeffs_image = coeffs_image[0:nmatrix]
+        return coeffs_image
+
+    def new_array(self, shape, dtype=np.float64, order='C'):
+        # a new (uninitialized) array: in memory, or out of core a
+        # memory-mapped file in work_dir
+        if not self.out_of_core:
+            return np.empty(shape, dtype=dtype, order=order)
+        if isinstance(shape, (int, np.integer)):
+            shape = (int(shape),)
+        work_file = os.path.join(self.work_dir, "{}-{}-{}.npy".format(
+            os.getpid(), id(self), next(self.work_counter)))
+        array = np.lib.format.open_memmap(work_file, mode='w+', dtype=dtype,
+                                          shape=shape, fortran_order=(order == 'F'))
+        try:
+            # the mapping stays valid: the disk space is released with the
+            # array (on Windows the open file cannot be removed)
+            os.remove(work_file)
+        except OSError:
+            self.work_files.append(work_file)
+        return array
+
+    def stored_array(self, array):
+        # a copy of array in a new_array
+        copy = self.new_array(array.shape, array.dtype)
+        copy[...] = array
+        return copy
+
+    def remove_work_files(self):
+        # remove the files of new_array left by the previous runs
+        work_files = self.work_files
+        self.work_files = []
+        for work_file in work_files:
+            try:
+                os.remove(work_file)
+            except OSError:
+                self.work_files.append(work_file)
+
+    def matrix_column(self, index, n_tracks, coeffs_audio):
+        # store the coefficients of the track index in the matrix of the
+        # least square problem (allocated by the first track, out of core)
+        # and return the column
+        if self.matrix is None:
+            self.matrix = self.new_array((coeffs_audio.size, n_tracks),
+                                         np.result_type(self.dtype, coeffs_audio.dtype),
+                                         order='F')
+        self.matrix[:, index] = coeffs_audio
+        return self.matrix[:, index]
+
+    def block_rows(self, n_columns):
+        # the number of rows of the blocks in which the matrix (n_columns
+        # columns and the right hand side) is streamed: about memory_budget
+        # bytes of complex double precision copies out of core
+        if not self.out_of_core:
+            return BLOCK_ROWS
+        return max(self.memory_budget // ((n_columns + 2) * 16), 1024)
+
+    def least_squares(self, ma, coeffs_image, matrix=None):
+        # solve the least square problem: the columns of the matrix are the
+        # coefficients of the music tracks (ma), the right hand side is the
+        # vector of the coefficients of the image (see PlayingPaintingsSolver.py).
+        # matrix is the matrix of ma, if it has already been built (out of core).
+        # In single precision and out of core, from the normal equations in
+        # double precision.
+        with self.profile('assemble'):
+            if matrix is None:
+                matrix = design_matrix(ma, self.dtype)
+            coeffs_image = self.align_size(coeffs_image, matrix.shape[0])
+
+        # alpha and the projection of the image onto the space of the tracks
+        with self.profile('solve'):
+            if self.out_of_core:
+                alpha, coeffs_projection = solve_normal_equations(
+                    matrix, coeffs_image, self.block_rows(matrix.shape[1]),
+                    out=self.new_array(coeffs_image.shape,
+                                       np.result_type(matrix.dtype, coeffs_image.dtype)))
+            elif self.single_precision:
+                alpha, coeffs_projection = solve_normal_equations(matrix, coeffs_image)
+            else:
+                alpha, coeffs_projection = solve_least_squares(matrix, coeffs_image)
+        del matrix
+        return alpha, coeffs_image, coeffs_projection
+
+    def reconstruct_audio_signal(self, coeffs_projection, len_coeffs_audio):
+        if self.transform <= 1:
+            coeffs = unpack_coeffs(coeffs_projection, len_coeffs_audio)
+            x = pywt.waverec(coeffs, self.mother_wavelet)
+        else:
+            # the signal of the hermitian part of the projection (see
+            # dft2_coeffs): the one of the real part of its coefficients
+            # (without the padding, see fft_length)
+            x = fft.irfft(unpack_rfft(coeffs_projection.real, len_coeffs_audio),
+                          len_coeffs_audio)[0:self.n_pixels]
+        signal = x.real / np.linalg.norm(x.real, np.inf)
+        signal = signal.flatten()
+        return signal
+
+    def normalized_distance(self, coeffs_image, coeffs_projection):
+        # compute the distance between the normalized spectrum of the image and
+        #  normalized spectrum of the projection
+        if self.single_precision or self.out_of_core:
+            # from the norms and the inner product, accumulated in double
+            # precision over blocks of entries:
+            # || c/|c| - p/|p| ||^2 = 2 - 2 Re(c^H p) / (|c| |p|)
+            products = np.zeros(3)
+            block_rows = self.block_rows(2)
+            for start in range(0, coeffs_image.size, block_rows):
+                c = coeffs_image[start:start+block_rows].astype(np.complex128)
+                p = coeffs_projection[start:start+block_rows].astype(np.complex128)
+                products += [np.vdot(c, c).real, np.vdot(p, p).real, np.vdot(c, p).real]
+            return float(cosine_to_distance(products[2] / np.sqrt(products[0] * products[1])))
+        painting_spectrum_norm = np.linalg.norm(coeffs_image)
+        projection_spectrum_norm = np.linalg.norm(coeffs_projection)
+        return np.linalg.norm(coeffs_image/painting_spectrum_norm -
+                              coeffs_projection/projection_spectrum_norm)
+
+    def write_audio(self, filename, signal):
+        # save the trace of the new piece of music
+        write_audio(filename, signal, self.my_sample_rate)
+
+
+def write_audio(filename, signal, sample_rate):
+    # save a trace (e.g. the new piece of music) as a wav file
+    soundfile.write(filename, signal, sample_rate, format='WAV')
+
+
+def print_profile(profiler, args, track_files):
+    # print (and log) the measures of the stages of the command line run
+    if profiler is None:
+        return
+    profiler.end()
+    print(profiler.report())
+    if args.profile_log is not None:
+        profiler.write_log(args.profile_log, painting=args.painting,
+                           tracks=track_files, transform=args.transform,
+                           wavelet=args.wavelet, levels=args.levels,
+                           scan=args.scan)
+
+
+def main(argv=None):
+    # command line entry point
+    parser = argparse.ArgumentParser(
+        description="Playing paintings: least square analysis of a painting "
+                    "and a set of music tracks, without the graphical interface.")
+    parser.add_argument("painting", help="the png file of the painting")
+    parser.add_argument("tracks", nargs="*",
+                        help="the mp3 (or wav) files of the music tracks")
+    parser.add_argument("--music-list", default=None,
+                        help="csv file with the list of the music tracks (e.g. "
+                             "musictracks.csv), added to the tracks above")
+    parser.add_argument("--music-dir", default="",
+                        help="directory of the music tracks of --music-list")
+    parser.add_argument("--scan", type=int, default=0, metavar="N",
+                        help="rank all the music tracks against the painting and "
+                             "choose the best subset of N tracks")
+    parser.add_argument("-t", "--transform", type=int, default=0,
+                        choices=range(len(TRANSFORMS)),
+                        help="0: " + TRANSFORMS[0] + ", 1: " + TRANSFORMS[1] +
+                             ", 2: " + TRANSFORMS[2] + ", 3: " + TRANSFORMS[3] +
+                             " (default 0)")
+    parser.add_argument("-w", "--wavelet", default="db5", choices=WAVELETS,
+                        help="mother wavelet, only for DWT (default db5)")
+    parser.add_argument("-l", "--levels", type=int, default=8,
+                        help="number of levels, only for DWT (default 8)")
+    parser.add_argument("--fast-length", action="store_true",
+                        help="pad the signals of DFT 1D unrolling (transform 2) to "
+                             "a length which is transformed fast")
+    parser.add_argument("--single-precision", action="store_true",
+                        help="single precision arrays (half the memory, the results "
+                             "change slightly)")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="MB",
+                        help="out of core analysis for very large paintings: the "
+                             "coefficients are stored in memory-mapped files and the "
+                             "least square problem is streamed in blocks of about MB "
+                             "megabytes")
+    parser.add_argument("--work-dir", default="./_cache/work/",
+                        help="directory of the memory-mapped files of --memory-budget "
+                             "(default ./_cache/work/)")
+    parser.add_argument("--preview", action="store_true",
+                        help="analyse a reduced painting (at most {} pixels) and as "
+                             "many samples of the music tracks".format(PREVIEW_PIXELS))
+    parser.add_argument("-o", "--output", default="sound1.wav",
+                        help="wav file of the new piece of music (default sound1.wav)")
+    parser.add_argument("--cache-dir", default="./_cache/audio/",
+                        help="directory of the cache of the decoded music tracks "
+                             "(default ./_cache/audio/)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always decode the music tracks")
+    parser.add_argument("--index-dir", default="./_cache/gram/",
+                        help="directory of the Gram-matrix index of the music "
+                             "tracks, used by --scan (default ./_cache/gram/)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of threads reading and transforming the "
+                             "music tracks (default: one for each track)")
+    parser.add_argument("--coeffs-cache-dir", default=None,
+                        help="directory where the transforms of the music tracks "
+                             "are saved and reused (default: not saved)")
+    parser.add_argument("--profile", action="store_true",
+                        help="print the time and the memory of each stage")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="with --profile, also trace the memory allocated by "
+                             "each stage (slower)")
+    parser.add_argument("--profile-log", default=None, metavar="LOG",
+                        help="append the measures of each stage to LOG, as a json "
+                             "line (implies --profile)")
+    args = parser.parse_args(argv)
+
+    track_files = list(args.tracks)
+    if args.music_list is not None:
+        track_files += [os.path.join(args.music_dir, item)
+                        for item in read_list(args.music_list)]
+    if not track_files:
+        parser.error("no music tracks")
+    memory_budget = None
+    if args.memory_budget is not None:
+        if args.scan > 0:
+            parser.error("--memory-budget cannot be used with --scan")
+        memory_budget = int(args.memory_budget * 2**20)
+
+    audio_cache = None
+    coeffs_cache = None
+    gram_index = None
+    if not args.no_cache:
+        audio_cache = AudioCache(args.cache_dir)
+        coeffs_cache = CoefficientCache(spill_dir=args.coeffs_cache_dir)
+        if args.scan > 0:
+            gram_index = GramIndex(args.index_dir)
+    profiler = None
+    if args.profile or args.profile_memory or args.profile_log is not None:
+        profiler = StageProfiler(trace_memory=args.profile_memory)
+    engine = PlayingPaintingsEngine(transform=args.transform,
+                                    mother_wavelet=args.wavelet,
+                                    wave_nlevels=args.levels,
+                                    audio_cache=audio_cache,
+                                    coeffs_cache=coeffs_cache,
+                                    gram_index=gram_index,
+                                    n_workers=args.workers,
+                                    profiler=profiler,
+                                    fast_length=args.fast_length,
+                                    single_precision=args.single_precision,
+                                    memory_budget=memory_budget,
+                                    work_dir=args.work_dir)
+    print("painting:", os.path.basename(args.painting))
+    print("transform:", TRANSFORMS[args.transform])
+
+    if args.preview:
+        engine = engine.preview_engine(args.painting) or engine
+        if engine.scale > 1:
+            print("preview: painting reduced by {} on each side".format(engine.scale))
+
+    if profiler is not None:
+        profiler.begin()
+    if args.scan > 0:
+        result = engine.scan_library(args.painting, track_files, n_best=args.scan)
+        print_profile(profiler, args, track_files)
+        print("ranking of the music tracks (normalized distance):")
+        for rank, k in enumerate(result.ranking):
+            print("{:4d}  {:.6f}  {}".format(rank + 1, result.distances[k],
+                                             os.path.basename(track_files[k])))
+        print("best subset of {} tracks:".format(len(result.best_subset)))
+        for k, item in enumerate(result.best_subset):
+            print("{:6.1f}%  {}".format(100 * result.alpha_percento[k],
+                                        os.path.basename(track_files[item])))
+        print("normalized distance: {:.6f}".format(result.distance))
+        return 0
+
+    result = engine.run(args.painting, track_files, output_file=args.output)
+    print_profile(profiler, args, track_files)
+    print("pixels:", result.n_pixels)
+    for k, item in enumerate(result.track_files):
+        print("{:6.1f}%  {}".format(100 * result.alpha_percento[k],
+                                    os.path.basename(item)))
+    print("normalized distance: {:.6f}".format(result.distance))
+    print("new piece of music saved in", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
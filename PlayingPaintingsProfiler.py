@@ -0,0 +1,169 @@
+############################################################################
+# Project: PlayingPaintings
+# Author: Paola Gervasio
+# https://github.com/pgerva/playing-paintings
+#
+# To cite this project: P. Gervasio, A. Quarteroni, D. Cassani.
+#            Let the paintings play. (2022)
+#            https://arxiv.org/abs/2206.14142
+#
+#  Copyright (C) 2022 by Paola Gervasio.
+#
+#   PlayingPaintings is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   PlayingPaintings is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with PlayingPaintings.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ####################################################################
+#
+# Time and memory of the stages of an analysis (see PlayingPaintingsEngine.py).
+# For each stage the profiler records the wall time, the cpu time of the
+# thread running it and the peak resident memory of the process; with
+# trace_memory=True also the peak of the memory allocated by python and
+# numpy during the stage (tracemalloc, which slows the analysis down).
+# When the engine has no profiler, the stages are not measured at all.
+#
+
+import os
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows: the resident memory is not recorded
+    resource = None
+
+
+def max_rss():
+    # peak resident memory of the process so far, in bytes (None if unknown)
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if os.uname().sysname == 'Darwin' else rss * 1024
+
+
+class StageProfiler:
+    # the measures of one run: begin() and end() delimit the run,
+    # stage(name, index) each of its stages (index is the index of the
+    # music track, -1 for the painting and for the other stages).
+    # The stages can run in several threads at the same time: their wall
+    # times overlap, and the memory peaks are the ones of the whole process
+    # while the stage was running.
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.total = {}
+        self.lock = threading.Lock()
+        self.started_tracemalloc = False
+        self.start_wall = None
+        self.start_cpu = None
+
+    def begin(self):
+        self.stages = []
+        self.total = {}
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    def end(self):
+        # the measures of the whole run (the cpu time includes all the threads)
+        self.total = {'wall': time.perf_counter() - self.start_wall,
+                      'cpu': time.process_time() - self.start_cpu,
+                      'max_rss': max_rss()}
+        if self.trace_memory:
+            self.total['peak_traced'] = tracemalloc.get_traced_memory()[1]
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+                self.started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name, index=-1):
+        if self.trace_memory:
+            traced_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        rss_start = max_rss()
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            measure = {'stage': name, 'index': index,
+                       'start': start_wall - (self.start_wall or start_wall),
+                       'wall': time.perf_counter() - start_wall,
+                       'cpu': time.thread_time() - start_cpu,
+                       'max_rss': max_rss()}
+            if rss_start is not None:
+                # how much this stage raised the peak of the process
+                measure['rss_growth'] = measure['max_rss'] - rss_start
+            if self.trace_memory:
+                measure['peak_traced'] = tracemalloc.get_traced_memory()[1] - traced_start
+            with self.lock:
+                self.stages.append(measure)
+
+    def totals(self):
+        # the measures of each stage, summed over the tracks
+        # (in the order of the first occurrence of the stages)
+        totals = {}
+        for measure in self.stages:
+            total = totals.setdefault(measure['stage'], {'wall': 0., 'cpu': 0., 'count': 0})
+            total['wall'] += measure['wall']
+            total['cpu'] += measure['cpu']
+            total['count'] += 1
+            for key in ('rss_growth', 'peak_traced'):
+                if key in measure:
+                    total[key] = max(total.get(key, 0), measure[key])
+        return totals
+
+    def summary(self):
+        # a short text, e.g. for the status bar
+        totals = self.totals()
+        text = ", ".join("{} {:.2f}s".format(name, total['wall'])
+                         for name, total in totals.items())
+        if self.total:
+            text = "total {:.2f}s: ".format(self.total['wall']) + text
+            if self.total.get('max_rss') is not None:
+                text += "; peak memory {:.0f} MB".format(self.total['max_rss'] / 2**20)
+        return text
+
+    def report(self):
+        # a table with one line for each stage
+        lines = ["{:<12s} {:>5s} {:>9s} {:>9s} {:>12s} {:>12s}".format(
+            "stage", "n", "wall [s]", "cpu [s]", "rss +[MB]", "traced [MB]")]
+        for name, total in self.totals().items():
+            lines.append("{:<12s} {:5d} {:9.3f} {:9.3f} {:>12s} {:>12s}".format(
+                name, total['count'], total['wall'], total['cpu'],
+                "{:.1f}".format(total['rss_growth'] / 2**20) if 'rss_growth' in total else "-",
+                "{:.1f}".format(total['peak_traced'] / 2**20) if 'peak_traced' in total else "-"))
+        if self.total:
+            lines.append("{:<12s} {:>5s} {:9.3f} {:9.3f}   peak rss {:s}".format(
+                "total", "", self.total['wall'], self.total['cpu'],
+                "{:.1f} MB".format(self.total['max_rss'] / 2**20)
+                if self.total.get('max_rss') is not None else "-"))
+        return "\n".join(lines)
+
+    def write_log(self, log_file, **info):
+        # append the measures of the run to log_file, as one json line;
+        # info describes the run (painting, tracks, transform, ...)
+        record = {'date': time.strftime("%Y-%m-%d %H:%M:%S")}
+        record.update(info)
+        record['total'] = self.total
+        record['stages'] = self.stages
+        with open(log_file, "a") as output_file:
+            output_file.write(json.dumps(record) + "\n")
@@ -0,0 +1,233 @@
+############################################################################
+# Project: PlayingPaintings
+# Author: Paola Gervasio
+# https://github.com/pgerva/playing-paintings
+#
+# To cite this project: P. Gervasio, A. Quarteroni, D. Cassani.
+#            Let the paintings play. (2022)
+#            https://arxiv.org/abs/2206.14142
+#
+#  Copyright (C) 2022 by Paola Gervasio.
+#
+#   PlayingPaintings is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   PlayingPaintings is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with PlayingPaintings.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ####################################################################
+#
+# The least square problem of PlayingPaintings:
+#
+#     find alpha minimizing || A alpha - c ||_2
+#
+# where the k columns of the n x k matrix A are the coefficients of the
+# music tracks and c is the vector of the coefficients of the painting.
+# The DWT coefficients are real, and so are the (packed) half spectra of
+# the DFT transforms (see pack_rfft in PlayingPaintingsEngine.py): A is
+# always real, while c is complex for the DFT - full 2D transform.
+#
+
+import numpy as np # pip install numpy
+import scipy.linalg # pip install scipy
+
+
+# the number of rows of the blocks in which gram_system reads the matrix
+BLOCK_ROWS = 2**16
+
+
+def design_matrix(ma, dtype=None):
+    # build the matrix A from the list ma of the coefficients of the tracks.
+    # The matrix is stored by columns (Fortran order), as LAPACK wants it,
+    # so that the QR factorization can work in place.
+    # The entries are double precision, unless dtype is given.
+    nmatrix = ma[-1].size
+    if dtype is None:
+        dtype = np.float64
+    dtype = np.result_type(dtype, *[item.dtype for item in ma])
+    matrix = np.empty([nmatrix, len(ma)], dtype=dtype, order='F')
+    for matrix_column, item in enumerate(ma):
+        matrix[:, matrix_column] = item
+    return matrix
+
+
+def solve_least_squares(matrix, c):
+    # solve min || matrix alpha - c || (c can also be a matrix, one right
+    # hand side for each column) by the thin QR factorization of the
+    # matrix (matrix = Q R): alpha = R^-1 Q^H c, projection = Q Q^H c.
+    # The matrix is overwritten. If the columns are (numerically) linearly
+    # dependent, e.g. the same track is selected twice, the minimum norm
+    # solution is computed by lstsq instead.
+    if np.iscomplexobj(c) and not np.iscomplexobj(matrix):
+        # a complex right hand side for a real matrix: the real and the
+        # imaginary part are two real problems with the same matrix
+        alpha, coeffs_projection = solve_least_squares(matrix,
+                                                       np.column_stack([c.real, c.imag]))
+        return (alpha[:, 0] + 1j * alpha[:, 1],
+                coeffs_projection[:, 0] + 1j * coeffs_projection[:, 1])
+
+    dtype = np.result_type(matrix.dtype, c.dtype)
+    if matrix.dtype != dtype:
+        matrix = matrix.astype(dtype, order='F')
+    c = c.astype(dtype, copy=False)
+
+    q, r = scipy.linalg.qr(matrix, mode='economic', overwrite_a=True,
+                           check_finite=False)
+    # the columns are dependent if a diagonal entry of R is at the level of
+    # the rounding of the factorization, max(n, k) eps |R| (as in lstsq)
+    diag_r = np.abs(np.diag(r))
+    tolerance = max(matrix.shape) * np.finfo(dtype).eps
+    if diag_r.size == 0 or np.amin(diag_r) <= tolerance * np.amax(diag_r):
+        matrix = np.matmul(q, r)
+        alpha = np.linalg.lstsq(matrix, c, rcond=None)[0]
+        coeffs_projection = np.matmul(matrix, alpha)
+        return alpha, coeffs_projection
+
+    qhc = np.matmul(q.conj().T, c)
+    alpha = scipy.linalg.solve_triangular(r, qhc, check_finite=False)
+    coeffs_projection = np.matmul(q, qhc)
+    return alpha, coeffs_projection
+
+
+def gram_system(matrix, c, block_rows=BLOCK_ROWS):
+    # the normal equations of min || matrix alpha - c ||: G = A^H A and
+    # b = A^H c, accumulated in double precision over blocks of block_rows
+    # rows, so that a single precision matrix is never copied as a whole
+    # and the sums over the n rows do not lose its 7 digits.
+    dtype = np.result_type(matrix.dtype, np.float64)
+    gram = np.zeros([matrix.shape[1], matrix.shape[1]], dtype=dtype)
+    b = np.zeros(matrix.shape[1:] + c.shape[1:], dtype=np.result_type(dtype, c.dtype))
+    for start in range(0, matrix.shape[0], block_rows):
+        block = matrix[start:start+block_rows].astype(dtype)
+        gram += np.matmul(block.conj().T, block)
+        b += np.matmul(block.conj().T, c[start:start+block_rows].astype(b.dtype))
+    return gram, b
+
+
+def solve_normal_equations(matrix, c, block_rows=BLOCK_ROWS, out=None):
+    # solve min || matrix alpha - c || (as solve_least_squares) from the
+    # k x k normal equations (see gram_system): alpha is double precision,
+    # the projection has the precision of the matrix and it is computed by
+    # blocks of rows too (in out, if given). The matrix is read only by
+    # blocks: it can be a memory-mapped array larger than the memory.
+    # Cond(G) = cond(A)^2: unlike the QR factorization, this loses the
+    # accuracy of alpha for nearly dependent columns; in double precision
+    # the rounding of G is far below the one of single precision entries of A.
+    # If the columns are (numerically, in the precision of the matrix)
+    # linearly dependent, the minimum norm solution is computed.
+    gram, b = gram_system(matrix, c, block_rows)
+    eigenvalues = np.linalg.eigvalsh(gram)
+    tolerance = gram.shape[0] * np.finfo(matrix.dtype).eps
+    if eigenvalues.size == 0 or eigenvalues[0] <= tolerance * eigenvalues[-1]:
+        alpha = np.linalg.lstsq(gram, b, rcond=tolerance)[0]
+    else:
+        alpha = scipy.linalg.solve(gram, b, assume_a='pos', check_finite=False)
+    dtype = np.result_type(matrix.dtype, c.dtype)
+    if out is None:
+        out = np.empty(matrix.shape[0:1] + c.shape[1:], dtype=dtype)
+    alpha_matrix = alpha.astype(dtype)
+    for start in range(0, matrix.shape[0], block_rows):
+        out[start:start+block_rows] = np.matmul(matrix[start:start+block_rows], alpha_matrix)
+    return alpha, out
+
+
+def orthogonalize(a, q):
+    # remove from a its components along the orthonormal vectors q
+    # (Gram-Schmidt, repeated twice for stability)
+    r = a
+    for i in range(2):
+        for q_i in q:
+            r = r - np.vdot(q_i, r) * q_i
+    return r
+
+
+def forward_selection(column, n_columns, c, n_best):
+    # Greedy (forward) selection of the n_best columns which best approximate c.
+    # column(j) returns the j-th candidate column, or None if it is not
+    # available; the columns are requested again at each step, so that only
+    # the orthonormal basis of the selected columns is kept in memory.
+    # Return the cosine of the angle between c and each single column
+    # (nan for the missing ones) and the indices of the selected columns,
+    # in the order they have been chosen.
+    c_norm = np.linalg.norm(c)
+    cosines = np.full(n_columns, np.nan)
+    selected = []
+    q = []
+    for step in range(min(n_best, n_columns)):
+        best_column = -1
+        best_gain = -1.
+        best_r = None
+        for j in range(n_columns):
+            if j in selected or (step > 0 and np.isnan(cosines[j])):
+                continue
+            a = column(j)
+            if a is None:
+                continue
+            a_norm = np.linalg.norm(a)
+            if step == 0:
+                cosines[j] = abs(np.vdot(a, c)) / (a_norm * c_norm)
+            r = orthogonalize(a, q)
+            r_norm = np.linalg.norm(r)
+            if r_norm <= a.size * np.finfo(float).eps * a_norm:
+                # a is (numerically) in the span of the selected columns
+                continue
+            # the norm of the component of c along the new direction
+            gain = abs(np.vdot(r, c)) / r_norm
+            if gain > best_gain:
+                best_column = j
+                best_gain = gain
+                best_r = r / r_norm
+        if best_column < 0:
+            break
+        selected.append(best_column)
+        q.append(best_r)
+    return cosines, selected
+
+
+def cosine_to_distance(cosine):
+    # normalized distance between c and its orthogonal projection p onto a
+    # subspace, from cosine = |p| / |c|: || c/|c| - p/|p| || = sqrt(2 - 2 cosine)
+    return np.sqrt(np.maximum(2 - 2 * cosine, 0))
+
+
+def gram_solve(gram, b, subset):
+    # Solve the least square problem for the columns in subset from the
+    # Gram matrix of the columns (gram = A^H A) and b = A^H c only:
+    # alpha = G^-1 b and |p|^2 = b^H alpha, where p is the projection of c.
+    # Return None if the columns are (numerically) linearly dependent.
+    g = gram[np.ix_(subset, subset)]
+    eigenvalues = np.linalg.eigvalsh(g)
+    if eigenvalues[0] <= len(subset) * np.finfo(float).eps * eigenvalues[-1]:
+        return None
+    alpha = np.linalg.solve(g, b[subset])
+    projection_norm2 = np.vdot(b[subset], alpha).real
+    return alpha, projection_norm2
+
+
+def gram_forward_selection(gram, b, n_best):
+    # forward selection (see forward_selection) from the Gram matrix of the
+    # columns and b = A^H c, without the columns: the missing columns have
+    # nan in b. Return the indices of the selected columns.
+    available = [j for j in range(b.size) if not np.isnan(b[j])]
+    selected = []
+    for step in range(min(n_best, len(available))):
+        best_column = -1
+        best_norm2 = -1.
+        for j in available:
+            if j in selected:
+                continue
+            solution = gram_solve(gram, b, selected + [j])
+            if solution is not None and solution[1] > best_norm2:
+                best_column = j
+                best_norm2 = solution[1]
+        if best_column < 0:
+            break
+        selected.append(best_column)
+    return selected
@@ -0,0 +1,143 @@
+############################################################################
+# Project: PlayingPaintings
+# Author: Paola Gervasio
+# https://github.com/pgerva/playing-paintings
+#
+# To cite this project: P. Gervasio, A. Quarteroni, D. Cassani.
+#            Let the paintings play. (2022)
+#            https://arxiv.org/abs/2206.14142
+#
+#  Copyright (C) 2022 by Paola Gervasio.
+#
+#   PlayingPaintings is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   PlayingPaintings is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with PlayingPaintings.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ####################################################################
+#
+# The small (200x200) reproductions of the paintings shown by the app.
+# This module only needs Pillow, so that the processes which generate the
+# images start quickly. The app generates the small image of a painting when
+# the painting is selected the first time; all of them can be generated in
+# advance (in parallel) from the command line:
+#
+#   python PlayingPaintingsThumbnails.py ../Paintings/ paintings.csv
+#
+
+import os
+import sys
+import csv
+import argparse
+from pathlib import Path
+from os.path import exists
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import PIL  # pip install Pillow
+from PIL import Image
+
+# the directory of the small images, and their size
+PAINTINGS_DIR_SMALL = "./_small/"
+SMALL_SIZE = 200
+
+
+def small_image_filename(img, paintings_dir_small=PAINTINGS_DIR_SMALL):
+    return os.path.join(paintings_dir_small, img + "_small.png")
+
+
+def small_image_is_valid(paintings_dir, img, paintings_dir_small=PAINTINGS_DIR_SMALL):
+    # the small image exists and it is newer than the painting
+    small_file = small_image_filename(img, paintings_dir_small)
+    if not exists(small_file):
+        return False
+    try:
+        return os.path.getmtime(small_file) >= os.path.getmtime(paintings_dir + img + ".png")
+    except OSError:
+        # the painting is missing: keep the small image
+        return True
+
+
+def make_small_image(paintings_dir, img, paintings_dir_small=PAINTINGS_DIR_SMALL):
+    # save the small reproduction of the painting img
+    with Image.open(paintings_dir + img + ".png") as im1:
+        if im1.height >= im1.width:
+            new_h = SMALL_SIZE
+            new_w = int(im1.width * SMALL_SIZE / im1.height)
+        else:
+            new_w = SMALL_SIZE
+            new_h = int(im1.height * SMALL_SIZE / im1.width)
+        # draft lets the decoder skip the resolution which is not needed (jpeg),
+        # reducing_gap downscales by an integer factor (Image.reduce) before the
+        # final Lanczos filter
+        im1.draft(im1.mode, (new_w, new_h))
+        im2 = im1.resize((new_w, new_h), Image.LANCZOS, reducing_gap=3.0)
+    # write to a temporary file, so that the app never loads a partial image
+    small_file = small_image_filename(img, paintings_dir_small)
+    tmp_file = small_file + ".{}.tmp.png".format(os.getpid())
+    im2.save(tmp_file, optimize=True, quality=95)
+    os.replace(tmp_file, small_file)
+    return img
+
+
+def read_paintings_list(paintings_list_filename):
+    # the names of the paintings (the first line of the file is not a name)
+    with open(paintings_list_filename, "r") as input_file:
+        menu_csv = list(csv.reader(input_file, delimiter="\n"))
+    menu_csv1 = []
+    for sublist in menu_csv:
+        for item in sublist:
+            menu_csv1.append(item)
+    return menu_csv1[1:]
+
+
+def generate_small_images(paintings_dir, paintings_list_filename, n_workers=None,
+                          ready=None):
+    # generate the small images which are missing or older than their painting,
+    # with n_workers processes (default: the number of cpus).
+    # ready(img) is called (in the calling thread) when the image of img is saved.
+
+# create the directory "./_small"
+    Path(PAINTINGS_DIR_SMALL).mkdir(parents=True, exist_ok=True)
+
+    images = [img for img in read_paintings_list(paintings_list_filename)
+              if not small_image_is_valid(paintings_dir, img)]
+    if not images:
+        return
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(make_small_image, paintings_dir, img): img
+                   for img in images}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as error:
+                print("WARNING: the small image of " + futures[future] +
+                      " cannot be generated:", error)
+                continue
+            if ready is not None:
+                ready(futures[future])
+
+
+def main(argv=None):
+    # command line entry point: generate all the small images
+    parser = argparse.ArgumentParser(
+        description="Playing paintings: generate the small images of the paintings "
+                    "in " + PAINTINGS_DIR_SMALL)
+    parser.add_argument("paintings_dir", help="directory of the paintings")
+    parser.add_argument("paintings_list", help="csv file with the list of the paintings")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes (default: the number of cpus)")
+    args = parser.parse_args(argv)
+    generate_small_images(args.paintings_dir, args.paintings_list,
+                          n_workers=args.workers, ready=print)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())